@@ -0,0 +1,72 @@
+"""
+Recall@k and latency of the IVF ANN backend (part2/server/ann.py) against
+exact search, unfiltered and with a facet restriction.
+
+Runs offline on synthetic clustered unit vectors.
+Usage:
+    python part2/benchmarks/bench_ann.py
+    python part2/benchmarks/bench_ann.py --rows 500000 --nprobe 4 8 16 32
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "server"))
+from ann import IVFIndex, default_nlist, train_ivf  # noqa: E402
+from vector_search import l2_normalize, search  # noqa: E402
+
+
+def _synthetic(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    centers = rng.standard_normal((max(1, n // 50), dim), dtype="float32")
+    vecs = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.standard_normal((n, dim), dtype="float32")
+    return l2_normalize(vecs)
+
+
+def _run(fn, queries):
+    t0 = time.perf_counter()
+    out = [fn(q)[0] for q in queries]
+    return out, (time.perf_counter() - t0) * 1e3 / len(queries)
+
+
+def _recall(truth, got, k):
+    return np.mean([len(set(a) & set(b)) / k for a, b in zip(truth, got)])
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--dim", type=int, default=256)
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--nlist", type=int, default=0)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    ap.add_argument("--facet-fraction", type=float, default=0.1, help="share of rows kept by the facet filter")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    vecs = _synthetic(args.rows, args.dim, rng)
+    queries = l2_normalize(vecs[rng.integers(0, args.rows, args.queries)]
+                           + 0.05 * rng.standard_normal((args.queries, args.dim), dtype="float32"))
+    facet = np.sort(rng.choice(args.rows, size=int(args.rows * args.facet_fraction), replace=False))
+
+    nlist = args.nlist or default_nlist(args.rows)
+    t0 = time.perf_counter()
+    ivf = IVFIndex.from_arrays(train_ivf(vecs, nlist))
+    print(f"rows={args.rows} dim={args.dim} nlist={nlist} train={time.perf_counter() - t0:.1f}s k={args.k}")
+
+    exact, exact_ms = _run(lambda q: search(vecs, q, args.k), queries)
+    exact_f, exact_f_ms = _run(lambda q: search(vecs, q, args.k, rows=facet), queries)
+    print(f"{'mode':>14} {'recall':>7} {'ms/q':>7} {'facet recall':>13} {'facet ms/q':>11}")
+    print(f"{'exact':>14} {1.0:>7.3f} {exact_ms:>7.2f} {1.0:>13.3f} {exact_f_ms:>11.2f}")
+    for nprobe in args.nprobe:
+        got, ms = _run(lambda q: ivf.search(vecs, q, args.k, nprobe=nprobe), queries)
+        got_f, ms_f = _run(lambda q: ivf.search(vecs, q, args.k, rows=facet, nprobe=nprobe), queries)
+        print(f"{f'ivf nprobe={nprobe}':>14} {_recall(exact, got, args.k):>7.3f} {ms:>7.2f} "
+              f"{_recall(exact_f, got_f, args.k):>13.3f} {ms_f:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
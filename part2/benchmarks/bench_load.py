@@ -0,0 +1,150 @@
+"""
+Open-loop load generator for the FastAPI server: requests are started on a
+fixed schedule (--rps), whether or not earlier ones have returned, so a slow
+server shows up as growing latency instead of a lower request rate.
+Each request is /chat or /collect according to --mix. The report gives
+throughput, p50/p95/p99 latency and error rates per endpoint.
+
+Run it against a server pointed at mock_aoai.py to load-test without Azure:
+    python part2/benchmarks/mock_aoai.py --port 8081 &
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8081 AZURE_OPENAI_API_KEY=mock python part2/server/main.py &
+    curl -X POST 'localhost:8000/build_index?wait=true'
+    python part2/benchmarks/bench_load.py --rps 50 --duration 60 --mix chat=0.8,collect=0.2
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+QUESTIONS_HE = [
+    "כמה עולה ניקוי שיניים?",
+    "האם יש הנחה על משקפיים?",
+    "מה ההטבות בדיקור סיני?",
+    "האם יש סדנאות להפסקת עישון?",
+    "מה מגיע לי בקלינאות תקשורת?",
+    "האם בדיקות הריון כלולות?",
+]
+QUESTIONS_EN = [
+    "How much does a dental cleaning cost?",
+    "Is there a discount on glasses?",
+    "What are the acupuncture benefits?",
+    "Are there smoking cessation workshops?",
+    "What do I get for speech therapy?",
+    "Are pregnancy tests covered?",
+]
+PROFILES = [
+    {"firstName": "Dana", "lastName": "Levi", "id": "123456789", "gender": "F", "age": 34,
+     "hmo": hmo, "hmoCard": "987654321", "tier": tier}
+    for hmo in ("מכבי", "מאוחדת", "כללית") for tier in ("זהב", "כסף", "ארד")
+]
+
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("chat", "collect"):
+            raise ValueError(f"Unknown endpoint '{name}' in --mix (expected chat / collect).")
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def make_request(kind: str, rng: random.Random, lang: str) -> Tuple[str, Dict[str, Any]]:
+    profile = rng.choice(PROFILES)
+    if kind == "chat":
+        question = rng.choice(QUESTIONS_EN if lang == "en" else QUESTIONS_HE)
+        return "/chat", {"user_info": profile, "question": question, "lang": lang}
+    # Intake à mi-parcours: une partie du profil déjà remplie
+    filled = rng.randint(0, len(profile) - 1)
+    partial = {k: v for i, (k, v) in enumerate(profile.items()) if i < filled}
+    return "/collect", {"user_info": partial, "history": [{"role": "user", "content": "hi"}], "lang": lang}
+
+
+async def _one(http: httpx.AsyncClient, path: str, body: Dict[str, Any], results: Dict[str, List], sem: Optional[asyncio.Semaphore]) -> None:
+    t0 = time.perf_counter()
+    try:
+        if sem is not None:
+            await sem.acquire()
+        try:
+            rsp = await http.post(path, json=body)
+            status = str(rsp.status_code)
+        finally:
+            if sem is not None:
+                sem.release()
+    except httpx.TimeoutException:
+        status = "timeout"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    results[path].append((time.perf_counter() - t0, status))
+
+
+async def run(args: argparse.Namespace) -> Dict[str, List]:
+    rng = random.Random(args.seed)
+    kinds, weights = zip(*parse_mix(args.mix))
+    results: Dict[str, List] = defaultdict(list)
+    sem = asyncio.Semaphore(args.max_inflight) if args.max_inflight else None
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as http:
+        tasks = []
+        start = time.perf_counter()
+        n = int(args.rps * args.duration)
+        for i in range(n):
+            delay = start + i / args.rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            path, body = make_request(rng.choices(kinds, weights)[0], rng, args.lang)
+            tasks.append(asyncio.create_task(_one(http, path, body, results, sem)))
+        await asyncio.gather(*tasks)
+        results["_elapsed"] = [time.perf_counter() - start]
+    return results
+
+
+def report(results: Dict[str, List], args: argparse.Namespace) -> Dict[str, Any]:
+    elapsed = results.pop("_elapsed")[0]
+    out: Dict[str, Any] = {"target_rps": args.rps, "elapsed_s": round(elapsed, 2), "endpoints": {}}
+    print(f"target {args.rps} rps for {args.duration}s -> elapsed {elapsed:.1f}s")
+    print(f"{'endpoint':>10} {'sent':>6} {'ok/s':>8} {'err %':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for path, rows in sorted(results.items()):
+        lat = np.array([r[0] for r in rows]) * 1e3
+        statuses = Counter(r[1] for r in rows)
+        ok = [r[0] * 1e3 for r in rows if r[1].startswith("2")]
+        p50, p95, p99 = (np.percentile(ok, [50, 95, 99]) if ok else (float("nan"),) * 3)
+        err = 1 - len(ok) / len(rows)
+        out["endpoints"][path] = {
+            "sent": len(rows), "ok_per_s": round(len(ok) / elapsed, 2), "error_rate": round(err, 4),
+            "p50_ms": round(float(p50), 1), "p95_ms": round(float(p95), 1), "p99_ms": round(float(p99), 1),
+            "max_ms": round(float(lat.max()), 1), "statuses": dict(statuses),
+        }
+        print(f"{path:>10} {len(rows):>6} {len(ok) / elapsed:>8.2f} {err * 100:>6.2f} "
+              f"{p50:>8.1f} {p95:>8.1f} {p99:>8.1f}  {dict(statuses)}")
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://localhost:8000")
+    ap.add_argument("--rps", type=float, default=10.0)
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds of scheduled requests")
+    ap.add_argument("--mix", default="chat=0.8,collect=0.2")
+    ap.add_argument("--lang", choices=("he", "en"), default="he")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--connections", type=int, default=200)
+    ap.add_argument("--max-inflight", type=int, default=0, help="cap on concurrent requests (0 = open loop)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", help="also write the report to this file")
+    args = ap.parse_args()
+
+    out = report(asyncio.run(run(args)), args)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(out, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Recall / RAM / latency comparison of the float16 and int8 index encodings
+(part2/server/index_store.py) against the exact float32 index.
+
+Runs offline. By default it uses the committed kb_index/vectors_original.npy;
+--synthetic N generates N clustered unit vectors instead.
+Usage:
+    python part2/benchmarks/bench_quantization.py
+    python part2/benchmarks/bench_quantization.py --synthetic 200000 --k 6
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "server"))
+from index_store import quantize  # noqa: E402
+from vector_search import l2_normalize, search  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+def _synthetic(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    # Vecteurs groupés autour de centres, plus proches de vrais embeddings que du bruit uniforme
+    centers = rng.standard_normal((max(1, n // 50), dim), dtype="float32")
+    vecs = centers[rng.integers(0, len(centers), n)] + 0.3 * rng.standard_normal((n, dim), dtype="float32")
+    return l2_normalize(vecs)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--vectors", type=Path, default=ROOT / "kb_index" / "vectors_original.npy")
+    ap.add_argument("--synthetic", type=int, default=0, help="number of synthetic rows (0 = use --vectors)")
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--noise", type=float, default=0.05, help="perturbation applied to rows used as queries")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        exact = _synthetic(args.synthetic, args.dim, rng)
+    else:
+        exact = l2_normalize(np.load(args.vectors))
+    n, dim = exact.shape
+    picks = rng.integers(0, n, args.queries)
+    queries = exact[picks] + args.noise * rng.standard_normal((args.queries, dim), dtype="float32") / np.sqrt(dim)
+
+    truth, _ = search(exact, queries, args.k)
+    print(f"rows={n} dim={dim} queries={args.queries} k={args.k}")
+    print(f"{'dtype':>8} {'MB':>9} {'bytes/row':>10} {f'recall@{args.k}':>10} {'top1':>6} {'ms/query':>9}")
+    for dtype in ("float32", "float16", "int8"):
+        stored, scales = quantize(exact, dtype)
+        nbytes = stored.nbytes + (scales.nbytes if scales is not None else 0)
+        t0 = time.perf_counter()
+        got, _ = search(stored, queries, args.k, scales=scales)
+        ms = (time.perf_counter() - t0) * 1e3 / args.queries
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(truth, got)])
+        top1 = np.mean(truth[:, 0] == got[:, 0])
+        print(f"{dtype:>8} {nbytes / 2**20:>9.2f} {nbytes / n:>10.0f} {recall:>10.4f} {top1:>6.3f} {ms:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark of the top-k search kernel (part2/server/vector_search.py) against
+the previous sklearn cosine_similarity + full argsort path.
+
+Runs offline on random unit vectors; no Azure call is made.
+Usage:
+    python part2/benchmarks/bench_search_kernel.py
+    python part2/benchmarks/bench_search_kernel.py --rows 2000 100000 1000000 --dim 1536 --k 6
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "server"))
+from vector_search import l2_normalize, search  # noqa: E402
+
+
+def _timeit(fn, repeat: int) -> float:
+    fn()  # warm-up
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _legacy(vecs: np.ndarray, q: np.ndarray, k: int):
+    from sklearn.metrics.pairwise import cosine_similarity
+    sims = cosine_similarity(q.reshape(1, -1), vecs)[0]
+    return np.argsort(-sims)[:k]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, nargs="+", default=[2_000, 20_000, 200_000, 1_000_000])
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--batch", type=int, default=16, help="queries per call for the batched measurement")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--skip-legacy", action="store_true")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'rows':>10} {'legacy ms':>10} {'kernel ms':>10} {'speedup':>8} {f'batch{args.batch} ms/q':>14}")
+    for n in args.rows:
+        vecs = l2_normalize(rng.standard_normal((n, args.dim), dtype="float32"))
+        q = rng.standard_normal(args.dim).astype("float32")
+        qs = rng.standard_normal((args.batch, args.dim)).astype("float32")
+
+        idx, _ = search(vecs, q, args.k)
+        legacy_ms = float("nan")
+        if not args.skip_legacy:
+            assert set(_legacy(vecs, q, args.k)) == set(idx), "kernel and legacy top-k disagree"
+            legacy_ms = _timeit(lambda: _legacy(vecs, q, args.k), args.repeat) * 1e3
+
+        kernel_ms = _timeit(lambda: search(vecs, q, args.k), args.repeat) * 1e3
+        batch_ms = _timeit(lambda: search(vecs, qs, args.k), args.repeat) * 1e3 / args.batch
+        print(f"{n:>10} {legacy_ms:>10.2f} {kernel_ms:>10.2f} {legacy_ms / kernel_ms:>7.1f}x {batch_ms:>14.3f}")
+        del vecs
+
+
+if __name__ == "__main__":
+    main()
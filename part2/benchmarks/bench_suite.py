@@ -0,0 +1,251 @@
+"""
+Offline regression suite for the knowledge-base pipeline: HTML parsing,
+index build, index load, strict facet filtering and search_basic, on
+synthetic corpora made by scaling up the phase2_data tables (every data row
+of every table is repeated N times under a numbered service name).
+
+No network: embeddings come from the deterministic hashing embedder
+(embedders.HashingEmbedder), and query embeddings are cached before search
+is timed. Each stage
+reports the best time per operation over --repeat rounds, then its peak
+Python/numpy allocation from a separate tracemalloc run (tracing slows the
+code down, so it never overlaps the timed rounds).
+
+Results are compared with the committed baseline (baseline.json, recorded
+with the machine and configuration it was measured on); a stage more than
+--tolerance slower or --mem-tolerance heavier than its baseline makes the
+run exit with status 1, and a missing baseline exits with status 2. Timings
+are noisy on small shared machines (up to ~95% between identical runs on the
+1-CPU reference VM), so the default time tolerance only catches gross
+slowdowns; lower it on a quiet dedicated machine. Re-record the baseline with
+--save-baseline when the reference machine or the benchmark itself changes.
+Usage:
+    python part2/benchmarks/bench_suite.py --save-baseline        # on the reference machine
+    python part2/benchmarks/bench_suite.py                        # compare with it
+    python part2/benchmarks/bench_suite.py --scales 10 100 --repeat 3
+"""
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from bs4 import BeautifulSoup
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "part2" / "server"))
+# kb_index crée son client Azure à l'import: valeurs factices, aucun appel n'est fait
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://localhost")
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "offline")
+
+import kb_index  # noqa: E402
+from embedders import HashingEmbedder  # noqa: E402
+from logger import json_logger  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baseline.json"
+FACETS = [(h, t) for h in ("maccabi", "meuhedet", "clalit") for t in ("gold", "silver", "bronze")]
+
+
+def scale_corpus(src_dir: Path, dst_dir: Path, factor: int) -> int:
+    """Write every phase2 HTML file with each table data row repeated `factor` times; returns bytes written."""
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    written = 0
+    for f in sorted(src_dir.glob("*.html")):
+        soup = BeautifulSoup(f.read_text(encoding="utf-8"), "html.parser")
+        for table in soup.find_all("table"):
+            rows = [tr for tr in table.find_all("tr") if tr.find("td")]
+            for row in rows:
+                anchor = row
+                for n in range(2, factor + 1):
+                    clone = copy.copy(row)
+                    name = clone.find("td")
+                    name.string = f"{name.get_text(strip=True)} {n}"
+                    anchor.insert_after(clone)
+                    anchor = clone
+        html = str(soup)
+        (dst_dir / f.name).write_text(html, encoding="utf-8")
+        written += len(html.encode("utf-8"))
+    return written
+
+
+def _best_per_op(fn: Callable[[], int], repeat: int) -> float:
+    """Best seconds per operation over `repeat` rounds; `fn` returns how many operations it ran."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        ops = fn()
+        best = min(best, (time.perf_counter() - t0) / max(1, ops))
+    return best
+
+
+def _peak_mb(fn: Callable[[], Any]) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def run_scale(factor: int, work: Path, args: argparse.Namespace) -> Tuple[Dict[str, Dict[str, float]], Dict[str, Any]]:
+    data_dir, index_dir = work / f"data_{factor}x", work / f"index_{factor}x"
+    corpus_bytes = scale_corpus(ROOT / "phase2_data", data_dir, factor)
+    kb_index.PHASE2_DATA_DIR, kb_index.INDEX_DIR = data_dir, index_dir
+    index_dir.mkdir(parents=True, exist_ok=True)
+    kb_index.index_manager.invalidate()
+    files = sorted(data_dir.glob("*.html"))
+    results: Dict[str, Dict[str, float]] = {}
+
+    def stage(name: str, fn: Callable[[], int]) -> None:
+        sec = _best_per_op(fn, args.repeat)
+        results[name] = {"ms_per_op": round(sec * 1e3, 4), "peak_mb": round(_peak_mb(fn), 2)}
+
+    def parse() -> int:
+        for f in files:
+            kb_index.parse_html(f)
+        return len(files)
+
+    entries_by_file = {str(f): kb_index._entries_from_parsed(kb_index.parse_html(f), f) for f in files}
+    hashes = {str(f): kb_index._file_sha256(f) for f in files}
+
+    def build() -> int:
+        kb_index._write_index("original", entries_by_file, hashes, {}, None)
+        return 1
+
+    def load() -> int:
+        kb_index.index_manager.invalidate()
+        kb_index.load_index_by_language("he")
+        return 1
+
+    stage("parse_html", parse)
+    stage("index_build", build)
+    stage("index_load", load)
+
+    idx = kb_index.index_manager.get("he")
+    meta = idx.meta
+
+    def strict_scan() -> int:
+        for hmo, tier in FACETS:
+            kb_index._strict_indices(meta, hmo, tier)
+        return len(FACETS)
+
+    def facet_strict() -> int:
+        for hmo, tier in FACETS:
+            idx.facets.strict(hmo, tier)
+        return len(FACETS)
+
+    rng = np.random.default_rng(0)
+    queries = [" ".join(meta[int(i)]["content"].split()[:4]) for i in rng.integers(0, len(meta), args.queries)]
+    for q in queries:
+        kb_index.embed_query(q)  # embeddings en cache: on mesure la recherche, pas l'embedder
+
+    def search() -> int:
+        for q in queries:
+            kb_index.search_basic(q, k=6, language="he")
+        return len(queries)
+
+    stage("strict_indices", strict_scan)
+    stage("facet_strict", facet_strict)
+    stage("search_basic", search)
+    info = {"rows": len(meta), "files": len(files), "corpus_mb": round(corpus_bytes / 2**20, 2)}
+    return results, info
+
+
+def run_config(args: argparse.Namespace) -> Dict[str, Any]:
+    """What the numbers depend on besides the code: compared with the baseline's before trusting it."""
+    return {
+        "machine": platform.node(), "platform": platform.platform(), "processor": platform.machine(),
+        "cpus": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__,
+        "dim": args.dim, "repeat": args.repeat, "queries": args.queries, "scales": args.scales,
+        "vector_dtype": kb_index.INDEX_VECTOR_DTYPE, "ann": kb_index.INDEX_ANN,
+        "retrieval": kb_index.RETRIEVAL_MODE,
+    }
+
+
+def compare(current: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float, mem_tolerance: float, min_ms: float, min_mb: float) -> List[str]:
+    failures: List[str] = []
+    for key, cur in current.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for field, tol, floor in (("ms_per_op", tolerance, min_ms), ("peak_mb", mem_tolerance, min_mb)):
+            b, c = base[field], cur[field]
+            if c > b * (1 + tol) and c - b > floor:
+                failures.append(f"{key} {field}: {c} vs baseline {b} (+{(c / b - 1) * 100 if b else float('inf'):.0f}%)")
+    return failures
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000])
+    ap.add_argument("--dim", type=int, default=256, help="hashing embedding size (1536 for ada-002 sized vectors)")
+    ap.add_argument("--repeat", type=int, default=5, help="rounds per stage; the best one is kept")
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true", help="write this run as the new baseline")
+    # Sur la VM de référence (1 CPU), deux runs identiques diffèrent jusqu'à ~95% (best-of-5);
+    # la mémoire de pointe, elle, est reproductible
+    ap.add_argument("--tolerance", type=float, default=1.0, help="allowed relative slowdown (ms/op)")
+    ap.add_argument("--mem-tolerance", type=float, default=0.25, help="allowed relative peak memory growth")
+    ap.add_argument("--min-ms", type=float, default=2.0, help="ignore slowdowns smaller than this (ms/op)")
+    ap.add_argument("--min-mb", type=float, default=1.0, help="ignore memory growth smaller than this (MB)")
+    ap.add_argument("--verbose", action="store_true", help="keep the server's JSON logs on stdout")
+    args = ap.parse_args()
+
+    kb_index.embedder = HashingEmbedder(args.dim)
+    if not args.verbose:
+        json_logger.stream = open(os.devnull, "w")
+
+    config = run_config(args)
+    baseline: Dict[str, Any] = {}
+    if not args.save_baseline:
+        if not args.baseline.exists():
+            print(f"no baseline at {args.baseline} (run with --save-baseline to record one)")
+            sys.exit(2)
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        recorded = baseline.get("config", {})
+        for key, value in config.items():
+            if key != "scales" and recorded.get(key) != value:
+                print(f"warning: baseline {key}={recorded.get(key)!r}, this run {key}={value!r}")
+
+    current: Dict[str, Dict[str, float]] = {}
+    print(f"{'scale':>6} {'stage':>15} {'ms/op':>10} {'peak MB':>9} {'vs base':>8}")
+    with tempfile.TemporaryDirectory(prefix="kb_bench_") as tmp:
+        for factor in args.scales:
+            results, info = run_scale(factor, Path(tmp), args)
+            print(f"{factor:>5}x rows={info['rows']} files={info['files']} corpus={info['corpus_mb']} MB")
+            for name, r in results.items():
+                key = f"{factor}x/{name}"
+                current[key] = r
+                base = baseline.get("results", {}).get(key)
+                delta = f"{(r['ms_per_op'] / base['ms_per_op'] - 1) * 100:+.0f}%" if base and base["ms_per_op"] else "-"
+                print(f"{'':>6} {name:>15} {r['ms_per_op']:>10.3f} {r['peak_mb']:>9.2f} {delta:>8}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({
+            "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "config": config, "results": current,
+        }, indent=2), encoding="utf-8")
+        print(f"baseline saved to {args.baseline}")
+        return
+    missing = sorted(set(current) - set(baseline.get("results", {})))
+    if missing:
+        print(f"warning: not in the baseline, not compared: {', '.join(missing)}")
+    failures = compare(current, baseline.get("results", {}), args.tolerance, args.mem_tolerance, args.min_ms, args.min_mb)
+    if failures:
+        print(f"\nREGRESSION ({len(failures)} over {args.tolerance:.0%} time / {args.mem_tolerance:.0%} memory tolerance):")
+        for line in failures:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"\nno regression vs baseline ({args.baseline.name}, tolerance {args.tolerance:.0%} time / {args.mem_tolerance:.0%} memory)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Local stand-in for the Azure OpenAI endpoints the server uses, for load tests
+that must not spend quota:
+
+    POST /openai/deployments/{deployment}/chat/completions   (plain and stream=True)
+    POST /openai/deployments/{deployment}/embeddings         (float and base64)
+
+Embeddings are deterministic (seeded by a hash of the input text). Chat
+completions return schema-valid JSON: a CollectResponse for the intake prompt,
+a ChatResponse for the Q&A prompt, and the input echoed back for translation
+requests. Latency is drawn from a configurable distribution and a fraction of
+requests can be answered with 429 + Retry-After to exercise the retry paths.
+Usage:
+    python part2/benchmarks/mock_aoai.py --port 8081 --chat-latency lognormal:800,0.4 --rate-429 0.02
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8081 AZURE_OPENAI_API_KEY=mock python part2/server/main.py
+"""
+import argparse
+import ast
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "server"))
+from models import ChatResponse, CollectResponse, UserInfo  # noqa: E402
+
+INTAKE_FIELDS = ["firstName", "lastName", "id", "gender", "age", "hmo", "hmoCard", "tier"]
+
+
+class Latency:
+    """Seconds drawn from fixed:MS | uniform:MIN_MS,MAX_MS | normal:MEAN_MS,SD_MS | lognormal:MEDIAN_MS,SIGMA."""
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        values = [float(x) for x in params.split(",") if x]
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(values) != expected[kind]:
+            raise ValueError(f"Invalid latency spec '{spec}' (e.g. fixed:50, uniform:20,80, lognormal:800,0.4).")
+        self.spec, self.kind, self.values = spec, kind, values
+
+    def sample(self) -> float:
+        v = self.values
+        if self.kind == "fixed":
+            ms = v[0]
+        elif self.kind == "uniform":
+            ms = random.uniform(v[0], v[1])
+        elif self.kind == "normal":
+            ms = random.gauss(v[0], v[1])
+        else:
+            ms = v[0] * random.lognormvariate(0.0, v[1])
+        return max(0.0, ms) / 1e3
+
+
+def fake_embedding(text: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim, dtype="float32")
+    return vec / np.linalg.norm(vec)
+
+
+def _system_text(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+
+
+def _collect_reply(messages: List[Dict[str, Any]]) -> str:
+    # main.py passe user_info et la langue dans le second message système
+    info: Dict[str, Any] = {}
+    lang = "en" if "preference is 'en'" in _system_text(messages) else "he"
+    for m in messages:
+        content = m.get("content") or ""
+        if m.get("role") == "system" and "current collected user info" in content:
+            raw = content.split(":\n", 1)[-1].rsplit(" and the language preference", 1)[0]
+            try:
+                info = ast.literal_eval(raw)  # repr() d'un dict Python
+            except (ValueError, SyntaxError):
+                info = {}
+    userinfo = UserInfo(**{k: v for k, v in info.items() if k in INTAKE_FIELDS})
+    missing = [f for f in INTAKE_FIELDS if not getattr(userinfo, f)]
+    phase = "ASK" if missing else "CONFIRM"
+    message = f"Could you tell me your {missing[0]}?" if missing else "Is everything correct?"
+    if lang == "he":
+        message = f"מה ה-{missing[0]} שלך?" if missing else "האם הפרטים נכונים?"
+    out = CollectResponse(phase=phase, message=message, missing=missing, userinfo=userinfo, lang=lang)
+    return out.model_dump_json()
+
+
+def _qa_reply(payload: Dict[str, Any]) -> str:
+    question = str(payload.get("question", ""))
+    snippets = payload.get("kb_snippets") or []
+    digest = hashlib.sha1(question.encode("utf-8")).hexdigest()[:8]
+    answer = (
+        f"Mock answer {digest} for '{question[:80]}', based on {len(snippets)} knowledge-base excerpts. "
+        "Eligibility and discounts depend on the HMO and tier listed in the excerpts."
+    )
+    return ChatResponse(answer=answer, sources=[s.split("\n", 1)[0][:60] for s in snippets[:3]]).model_dump_json()
+
+
+def completion_text(messages: List[Dict[str, Any]]) -> str:
+    last = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    if "IntakeAgent" in _system_text(messages):
+        return _collect_reply(messages)
+    try:
+        payload = json.loads(last)
+    except ValueError:
+        payload = None
+    if isinstance(payload, dict) and "question" in payload:
+        return _qa_reply(payload)
+    # Traduction (kb_index.translate_file): renvoie le contenu tel quel
+    return last.split(": ", 1)[-1]
+
+
+def create_app(chat_latency: Latency, embed_latency: Latency, rate_429: float, retry_after: float,
+               embed_dim: int, stream_chunk_chars: int) -> FastAPI:
+    app = FastAPI(title="Azure OpenAI mock")
+    stats = {"chat": 0, "embeddings": 0, "throttled": 0}
+
+    def throttled() -> JSONResponse:
+        stats["throttled"] += 1
+        return JSONResponse(
+            status_code=429,
+            content={"error": {"code": "429", "message": "Rate limit is exceeded (mock). Try again later."}},
+            headers={"Retry-After": str(max(1, round(retry_after))), "retry-after-ms": str(int(retry_after * 1e3))},
+        )
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def chat_completions(deployment: str, request: Request):
+        if random.random() < rate_429:
+            return throttled()
+        stats["chat"] += 1
+        body = await request.json()
+        text = completion_text(body.get("messages", []))
+        latency = chat_latency.sample()
+        rid, created = f"chatcmpl-{uuid.uuid4().hex[:12]}", int(time.time())
+        usage = {"prompt_tokens": sum(len(str(m.get("content", ""))) // 4 for m in body.get("messages", [])),
+                 "completion_tokens": len(text) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return {
+                "id": rid, "object": "chat.completion", "created": created, "model": deployment,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": usage,
+            }
+
+        pieces = [text[i:i + stream_chunk_chars] for i in range(0, len(text), stream_chunk_chars)] or [""]
+
+        def chunk(delta: Dict[str, Any], finish: Any = None) -> str:
+            data = {"id": rid, "object": "chat.completion.chunk", "created": created, "model": deployment,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def events():
+            # Comme Azure: un premier chunk sans choices (résultats des filtres de contenu)
+            yield f"data: {json.dumps({'id': '', 'object': '', 'created': 0, 'model': '', 'choices': []})}\n\n"
+            await asyncio.sleep(latency * 0.3)  # temps jusqu'au premier token
+            yield chunk({"role": "assistant", "content": ""})
+            for piece in pieces:
+                await asyncio.sleep(latency * 0.7 / len(pieces))
+                yield chunk({"content": piece})
+            yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/openai/deployments/{deployment}/embeddings")
+    async def embeddings(deployment: str, request: Request):
+        if random.random() < rate_429:
+            return throttled()
+        stats["embeddings"] += 1
+        body = await request.json()
+        inputs = body.get("input", [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        as_base64 = body.get("encoding_format") == "base64"
+        data = []
+        for i, text in enumerate(inputs):
+            vec = fake_embedding(str(text), embed_dim)
+            emb: Any = base64.b64encode(vec.tobytes()).decode("ascii") if as_base64 else vec.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": emb})
+        await asyncio.sleep(embed_latency.sample())
+        tokens = sum(len(str(t)) // 4 for t in inputs)
+        return {"object": "list", "data": data, "model": deployment,
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--chat-latency", default="lognormal:800,0.4", help="fixed:MS | uniform:A,B | normal:MEAN,SD | lognormal:MEDIAN,SIGMA")
+    ap.add_argument("--embed-latency", default="lognormal:60,0.3")
+    ap.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests answered with 429")
+    ap.add_argument("--retry-after", type=float, default=1.0, help="seconds advertised in Retry-After on 429")
+    ap.add_argument("--embed-dim", type=int, default=1536)
+    ap.add_argument("--stream-chunk-chars", type=int, default=8)
+    args = ap.parse_args()
+
+    app = create_app(Latency(args.chat_latency), Latency(args.embed_latency), args.rate_429, args.retry_after,
+                     args.embed_dim, args.stream_chunk_chars)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import os
 import json
+import itertools
+import time
 import requests
 import streamlit as st
 from dotenv import load_dotenv
@@ -32,6 +34,36 @@ BASE_CSS = """
 """
 st.markdown(BASE_CSS, unsafe_allow_html=True)
 
+def stream_events(url, payload, timeout=120):
+    """Yield (event, data) pairs from a server-sent-events endpoint."""
+    with requests.post(url, json=payload, stream=True, timeout=timeout) as r:
+        if r.status_code != 200:
+            try:
+                detail = r.json().get("detail", r.text)
+            except ValueError:
+                detail = r.text
+            yield "error", {"error": detail}
+            return
+        r.encoding = "utf-8"
+        event = "message"
+        for line in r.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:"):].strip())
+
+
+def build_progress_text(job):
+    """One line per index of a build job, e.g. 'original: embed' or 'translated: parsed 12/40'."""
+    parts = []
+    for name, p in (job.get("progress") or {}).items():
+        text = f"{name}: {p.get('step') or p.get('stage', '')}"
+        if p.get("total"):
+            text += f" {p.get('done', 0)}/{p['total']}"
+        parts.append(text)
+    return " · ".join(parts) or job.get("status", "")
+
+
 # ==================== Stateless client-state ====================
 if "lang" not in st.session_state:
     st.session_state.lang = "he"
@@ -143,9 +175,19 @@ with st.sidebar:
     with col_sb2:
         if st.button(t['sidebar_build_index'], use_container_width=True):
             try:
+                # The build runs as a background job on the server: poll its status
+                job = requests.post(f"{API_BASE}/build_index", timeout=30).json()
+                progress = st.empty()
                 with st.spinner("Building KB on server..."):
-                    r = requests.post(f"{API_BASE}/build_index", timeout=180)
-                st.success(r.json())
+                    while job.get("status") in ("queued", "running"):
+                        time.sleep(2)
+                        job = requests.get(f"{API_BASE}/build_index/{job['job_id']}", timeout=30).json()
+                        progress.caption(build_progress_text(job))
+                progress.empty()
+                if job.get("status") == "succeeded":
+                    st.success(job.get("result"))
+                else:
+                    st.error(job.get("error") or job)
             except Exception as e:
                 st.error(str(e))
 
@@ -247,11 +289,25 @@ elif st.session_state.active_tab == "qa" and st.session_state.intake_done:
             "question": prompt,
             "lang": lang
         }
-        with st.spinner(t["spinner_searching"]):
-            r = requests.post(f"{API_BASE}/chat", json=payload, timeout=120)
-        res = r.json()
-        if "detail" in res:
-            st.error(res["detail"])
+        # Stream the answer: sources arrive first, then tokens, then the final ChatResponse
+        res = {}
+        with tab2:
+            with st.chat_message("assistant"):
+                placeholder = st.empty()
+                partial = ""
+                with st.spinner(t["spinner_searching"]):
+                    events = stream_events(f"{API_BASE}/chat/stream", payload, timeout=120)
+                    first = next(events, ("error", {"error": "Empty response from server"}))
+                for event, data in itertools.chain([first], events):
+                    if event == "token":
+                        partial += data.get("text", "")
+                        placeholder.markdown(f"**{t['answer_title']}:** {partial}▌")
+                    elif event == "done":
+                        res = data
+                    elif event == "error":
+                        res = {"detail": data.get("error", "")}
+        if "detail" in res or not res:
+            st.error(res.get("detail") or "No answer received")
         else:
             answer = res.get("answer", "")
             sources = res.get("sources", []) or []
@@ -0,0 +1,109 @@
+"""
+Approximate nearest-neighbour search: IVF-flat over the normalized index.
+
+Rows are partitioned by a spherical k-means coarse quantizer; a query only
+scores the rows of its `nprobe` closest lists. Built at index-build time and
+stored next to the vectors as three arrays (see index_store extra arrays):
+
+    ivf_centroids   float32 (nlist, dim)
+    ivf_offsets     int64   (nlist + 1)   list boundaries into ivf_rows
+    ivf_rows        int64   (rows,)       row ids grouped by list, ascending inside a list
+"""
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from vector_search import BLOCK_ROWS, l2_normalize, search, top_k
+
+
+def default_nlist(n_rows: int) -> int:
+    return max(1, int(4 * np.sqrt(n_rows)))
+
+
+def _assign(vecs: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    out = np.empty(vecs.shape[0], dtype=np.int64)
+    for a in range(0, vecs.shape[0], BLOCK_ROWS):
+        block = np.asarray(vecs[a:a + BLOCK_ROWS], dtype="float32")
+        out[a:a + BLOCK_ROWS] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def train_ivf(
+    vecs: np.ndarray,
+    nlist: int,
+    iters: int = 10,
+    sample: int = 64,
+    seed: int = 0,
+) -> Dict[str, np.ndarray]:
+    """Spherical k-means on a sample of `nlist * sample` rows, then assign every row."""
+    rng = np.random.default_rng(seed)
+    n = vecs.shape[0]
+    nlist = max(1, min(nlist, n))
+    train_rows = np.sort(rng.choice(n, size=min(n, nlist * sample), replace=False))
+    train = np.asarray(vecs[train_rows], dtype="float32")
+    centroids = train[rng.choice(len(train), size=nlist, replace=False)].copy()
+    for _ in range(iters):
+        labels = _assign(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # listes vides: réensemencées sur des points d'entraînement au hasard
+            sums[empty] = train[rng.choice(len(train), size=int(empty.sum()), replace=False)]
+        centroids = l2_normalize(sums)
+
+    labels = _assign(vecs, centroids)
+    order = np.argsort(labels, kind="stable")
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(labels, minlength=nlist), out=offsets[1:])
+    return {"ivf_centroids": centroids, "ivf_offsets": offsets, "ivf_rows": order.astype(np.int64)}
+
+
+class IVFIndex:
+    """Query side of an IVF-flat index; same (indices, scores) contract as vector_search.search."""
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, rows: np.ndarray, nprobe: int = 8):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.nprobe = nprobe
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], nprobe: int = 8) -> "IVFIndex":
+        return cls(arrays["ivf_centroids"], arrays["ivf_offsets"], arrays["ivf_rows"], nprobe)
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        probes, _ = top_k(self.centroids @ l2_normalize(query), nprobe or self.nprobe)
+        parts = [self.rows[self.offsets[c]:self.offsets[c + 1]] for c in probes]
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def search(
+        self,
+        vecs: np.ndarray,
+        queries: np.ndarray,
+        k: int,
+        rows: Optional[Union[slice, np.ndarray]] = None,
+        scales: Optional[np.ndarray] = None,
+        nprobe: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if np.ndim(queries) == 2:
+            res = [self.search(vecs, q, k, rows, scales, nprobe) for q in queries]
+            return np.stack([r[0] for r in res]), np.stack([r[1] for r in res])
+
+        cand = self.candidates(queries, nprobe)
+        if isinstance(rows, slice):
+            cand = cand[(cand >= (rows.start or 0)) & (cand < rows.stop)]
+        elif rows is not None:
+            cand = cand[np.isin(cand, rows, assume_unique=True)]
+        eligible = (rows.stop - (rows.start or 0)) if isinstance(rows, slice) else (
+            vecs.shape[0] if rows is None else len(rows)
+        )
+        if len(cand) < min(k, eligible):
+            # trop peu de candidats dans les listes sondées (facette étroite): recherche exacte
+            return search(vecs, queries, k, rows=rows, scales=scales)
+        return search(vecs, queries, k, rows=cand, scales=scales)
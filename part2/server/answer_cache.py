@@ -0,0 +1,330 @@
+"""
+Response cache for /chat.
+
+The Q&A completion runs at temperature 0, so the same question asked by the
+same HMO/tier in the same language over the same retrieved chunks yields the
+same ChatResponse. Entries are keyed on exactly that (plus the index
+generation and chat deployment) and expire after a TTL; the least recently
+used entries are evicted beyond `max_items`.
+
+Backends:
+    memory   per-process OrderedDict (default)
+    sqlite   shared file, survives restarts and is visible to every worker
+
+SemanticAnswerCache catches rephrasings of an already answered question: it
+compares the question embedding (computed by the search anyway) with those
+of previous questions of the same HMO/tier/lang facet and index generation.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from kb_index import canon_hmo, canon_tier, normalize_query
+from vector_search import l2_normalize
+
+ANSWER_CACHE_BACKEND = os.getenv("ANSWER_CACHE_BACKEND", "memory")  # memory | sqlite | off
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL_SECS = float(os.getenv("ANSWER_CACHE_TTL_SECS", "3600"))
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "cache/answers.sqlite")
+ANSWER_CACHE_TOUCH_BATCH = int(os.getenv("ANSWER_CACHE_TOUCH_BATCH", "64"))  # used_at écrits par lot (sqlite)
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "2048"))  # 0 = désactivé
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+
+Entry = Tuple[float, str]  # (expires_at, payload JSON)
+
+
+class MemoryBackend:
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._items: "OrderedDict[str, Entry]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Entry]:
+        entry = self._items.get(key)
+        if entry is not None:
+            self._items.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: Entry) -> int:
+        self._items[key] = entry
+        self._items.move_to_end(key)
+        evicted = 0
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def delete(self, key: str) -> None:
+        self._items.pop(key, None)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class SQLiteBackend:
+    """
+    Reads do not write: the used_at of the entries they return is kept in
+    memory and written with the next put (or every `touch_batch` reads), so a
+    cache hit costs one SELECT and no commit.
+    """
+
+    def __init__(self, max_items: int, path: str, touch_batch: int = ANSWER_CACHE_TOUCH_BATCH):
+        self.max_items = max_items
+        self.touch_batch = touch_batch
+        self._touched: Dict[str, float] = {}
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, payload TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_used ON answers (used_at)")
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[Entry]:
+        row = self._db.execute("SELECT expires_at, payload FROM answers WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch:
+                self._write_touched()
+                self._db.commit()
+        return row
+
+    def _write_touched(self) -> None:
+        if self._touched:
+            self._db.executemany(
+                "UPDATE answers SET used_at = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def put(self, key: str, entry: Entry) -> int:
+        now = time.time()
+        self._write_touched()  # l'éviction LRU ci-dessous doit voir les lectures récentes
+        self._db.execute(
+            "INSERT OR REPLACE INTO answers (key, payload, expires_at, used_at) VALUES (?, ?, ?, ?)",
+            (key, entry[1], entry[0], now),
+        )
+        self._db.execute("DELETE FROM answers WHERE expires_at <= ?", (now,))
+        cur = self._db.execute(
+            "DELETE FROM answers WHERE key IN ("
+            "SELECT key FROM answers ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_items,),
+        )
+        self._db.commit()
+        return cur.rowcount
+
+    def delete(self, key: str) -> None:
+        self._touched.pop(key, None)
+        self._db.execute("DELETE FROM answers WHERE key = ?", (key,))
+        self._db.commit()
+
+    def clear(self) -> None:
+        self._touched.clear()
+        self._db.execute("DELETE FROM answers")
+        self._db.commit()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+
+class AnswerCache:
+    """
+    TTL + LRU cache of ChatResponse payloads.
+    Usage:
+        key = AnswerCache.key(question, hmo, tier, lang, chunk_ids, generation, deployment)
+        data = answer_cache.get(key)      # dict or None
+        answer_cache.put(key, out.model_dump())
+    """
+
+    def __init__(self, backend: str = ANSWER_CACHE_BACKEND, max_items: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL_SECS, path: str = ANSWER_CACHE_PATH):
+        self.enabled = backend != "off" and max_items > 0
+        self.backend_name = backend
+        self.ttl = ttl
+        if backend == "sqlite":
+            self._backend: Any = SQLiteBackend(max_items, path)
+        elif backend in ("memory", "off"):
+            self._backend = MemoryBackend(max_items)
+        else:
+            raise ValueError(f"Unknown ANSWER_CACHE_BACKEND '{backend}' (expected memory | sqlite | off).")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(question: str, hmo: str, tier: str, lang: str, chunk_ids: Sequence[Any],
+            generation: int, deployment: str = "") -> str:
+        raw = json.dumps([
+            normalize_query(question), canon_hmo(hmo), canon_tier(tier), lang,
+            list(chunk_ids), int(generation), deployment,
+        ], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._backend.get(key)
+            if entry is not None and entry[0] <= time.time():
+                self._backend.delete(key)
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(entry[1])
+
+    def put(self, key: str, data: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        entry = (time.time() + self.ttl, json.dumps(data, ensure_ascii=False))
+        with self._lock:
+            self.evictions += self._backend.put(key, entry)
+
+    def clear(self) -> None:
+        """Drop every entry (called when a new index generation goes live)."""
+        with self._lock:
+            self._backend.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        with self._lock:
+            size = len(self._backend)
+        return {
+            "backend": self.backend_name if self.enabled else "off",
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "size": size,
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+answer_cache = AnswerCache()
+
+
+class SemanticAnswerCache:
+    """
+    Bounded in-process vector store of answered questions. A lookup returns
+    the cached payload of the most similar question of the same facet when
+    its cosine similarity reaches `threshold`; beyond `max_items` the least
+    recently used slot is reused.
+    Usage:
+        facet = SemanticAnswerCache.facet(hmo, tier, lang, generation)
+        found = semantic_cache.get(facet, qvec)     # (dict, similarity) or None
+        semantic_cache.put(facet, qvec, out.model_dump())
+    """
+
+    def __init__(self, max_items: int = SEMANTIC_CACHE_SIZE, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl: float = ANSWER_CACHE_TTL_SECS):
+        self.enabled = max_items > 0
+        self.max_items = max_items
+        self.threshold = threshold
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vecs: Optional[np.ndarray] = None  # (max_items, dim), alloué au premier put
+        self._facet = np.full(max_items, -1, dtype=np.int64)  # -1 = slot libre
+        self._expires = np.zeros(max_items, dtype=np.float64)
+        self._used = np.zeros(max_items, dtype=np.float64)
+        self._payloads: list = [None] * max_items
+        # facette -> id tant qu'au moins un slot la porte: au plus max_items entrées
+        self._facet_ids: Dict[Tuple, int] = {}
+        self._facet_keys: Dict[int, Tuple] = {}
+        self._next_facet_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def facet(hmo: str, tier: str, lang: str, generation: int) -> Tuple:
+        return canon_hmo(hmo), canon_tier(tier), lang, int(generation)
+
+    def get(self, facet: Tuple, qvec: np.ndarray) -> Optional[Tuple[Dict[str, Any], float]]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            fid = self._facet_ids.get(facet)
+            slots = np.zeros(0, dtype=np.int64)
+            if fid is not None and self._vecs is not None:
+                slots = np.flatnonzero((self._facet == fid) & (self._expires > time.time()))
+            if len(slots):
+                sims = self._vecs[slots] @ l2_normalize(np.asarray(qvec, dtype="float32"))
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    slot = int(slots[best])
+                    self._used[slot] = time.monotonic()
+                    self.hits += 1
+                    return self._payloads[slot], float(sims[best])
+            self.misses += 1
+            return None
+
+    def put(self, facet: Tuple, qvec: np.ndarray, data: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        qvec = l2_normalize(np.asarray(qvec, dtype="float32"))
+        with self._lock:
+            if self._vecs is None or self._vecs.shape[1] != qvec.shape[0]:
+                self._vecs = np.zeros((self.max_items, qvec.shape[0]), dtype="float32")
+                self._facet[:] = -1
+                self._facet_ids.clear()
+                self._facet_keys.clear()
+            free = np.flatnonzero((self._facet < 0) | (self._expires <= time.time()))
+            if len(free):
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self._used))
+                self.evictions += 1
+            old = int(self._facet[slot])
+            fid = self._facet_ids.get(facet)
+            if fid is None:
+                fid = self._next_facet_id
+                self._next_facet_id += 1
+                self._facet_ids[facet], self._facet_keys[fid] = fid, facet
+            self._vecs[slot] = qvec
+            self._facet[slot] = fid
+            if old >= 0 and old != fid and not (self._facet == old).any():
+                del self._facet_ids[self._facet_keys.pop(old)]
+            self._expires[slot] = time.time() + self.ttl
+            self._used[slot] = time.monotonic()
+            self._payloads[slot] = data
+
+    def clear(self) -> None:
+        with self._lock:
+            self._facet[:] = -1
+            self._payloads = [None] * self.max_items
+            self._facet_ids.clear()
+            self._facet_keys.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "threshold": self.threshold if self.enabled else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "size": int((self._facet >= 0).sum()),
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+semantic_cache = SemanticAnswerCache()
@@ -0,0 +1,208 @@
+"""
+Background index builds.
+
+POST /build_index only queues a job; the build itself runs on a single worker
+thread (one build at a time) and reports its stages through the progress
+callback of kb_index.build_index. Every build writes a new generation
+directory and swaps CURRENT only once it is complete, so searches keep using
+the previous generation until then (and until their own call returns).
+
+With several uvicorn workers, each job's state is also written to
+<state_dir>/<job_id>.json, so any worker can answer GET /build_index/{job_id}
+for a build started by another one.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from logger import log, request_id_var
+
+BUILD_JOBS_KEEP = int(os.getenv("BUILD_JOBS_KEEP", "20"))
+BUILD_JOBS_SAVE_SECS = float(os.getenv("BUILD_JOBS_SAVE_SECS", "1.0"))  # écriture max. de la progression
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # processus d'un autre utilisateur
+    return True
+
+
+class BuildJob:
+    def __init__(self, full: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.full = full
+        self.status = "queued"  # queued | running | succeeded | failed
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.stages: Dict[str, Dict[str, Any]] = {}  # index -> dernier état connu
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.pid = os.getpid()
+        self.on_change: Optional[Callable[["BuildJob", bool], None]] = None
+        # build_index rapporte depuis deux threads (index original et traduit)
+        self.lock = threading.RLock()
+
+    def on_progress(self, event: str, fields: Dict[str, Any]) -> None:
+        index = fields.get("index", "?")
+        with self.lock:
+            state = self.stages.setdefault(index, {})
+            if event == "build_stage":
+                state.clear()
+                state.update({"stage": fields.get("stage"), "updated_at": time.time()})
+                if fields.get("stage") == "done":
+                    state.update({k: v for k, v in fields.items() if k not in ("index", "stage")})
+            else:
+                state.update({
+                    "step": fields.get("stage"), "done": fields.get("done"), "total": fields.get("total"),
+                    "file": fields.get("file"), "updated_at": time.time(),
+                })
+        if self.on_change is not None:
+            self.on_change(self, event == "build_stage")
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "BuildJob":
+        """Snapshot of a job saved by (possibly) another worker."""
+        job = cls(bool(d.get("full")))
+        job.id, job.status, job.pid = d["job_id"], d["status"], int(d.get("pid", 0))
+        job.created_at, job.started_at, job.finished_at = d["created_at"], d.get("started_at"), d.get("finished_at")
+        job.stages, job.result, job.error = d.get("progress") or {}, d.get("result"), d.get("error")
+        if job.status in ("queued", "running") and job.pid and not _pid_alive(job.pid):
+            job.status, job.error = "failed", f"worker {job.pid} exited before the build finished"
+        return job
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            stages = {index: dict(state) for index, state in self.stages.items()}
+        end = self.finished_at or time.time()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "full": self.full,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_seconds": round((self.started_at or end) - self.created_at, 2),
+            "run_seconds": round(end - self.started_at, 2) if self.started_at else None,
+            "progress": stages,
+            "result": self.result,
+            "error": self.error,
+            "pid": self.pid,
+        }
+
+
+class BuildJobs:
+    """
+    Registry of the last BUILD_JOBS_KEEP build jobs. With a `state_dir`, jobs
+    are shared with the other worker processes through one JSON file per job.
+    Usage:
+        job = build_jobs.submit(full=False)     # returns immediately
+        build_jobs.get(job.id).to_dict()
+    """
+
+    def __init__(self, build_fn: Callable[..., Dict[str, Any]],
+                 on_success: Optional[Callable[[Dict[str, Any]], None]] = None, keep: int = BUILD_JOBS_KEEP,
+                 state_dir: Optional[Path] = None):
+        self.build_fn = build_fn
+        self.on_success = on_success
+        self.keep = keep
+        self.state_dir = state_dir
+        self._jobs: "OrderedDict[str, BuildJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._saved_at: Dict[str, float] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="build")
+        if state_dir is not None:
+            state_dir.mkdir(parents=True, exist_ok=True)
+
+    def _save(self, job: BuildJob, force: bool = True) -> None:
+        if self.state_dir is None:
+            return
+        # Sous le verrou du job: un seul thread écrit son fichier, dans l'ordre des états
+        with job.lock:
+            now = time.time()
+            if not force and now - self._saved_at.get(job.id, 0.0) < BUILD_JOBS_SAVE_SECS:
+                return
+            self._saved_at[job.id] = now
+            path = self.state_dir / f"{job.id}.json"
+            tmp = path.with_name(f".{path.name}.tmp-{os.getpid()}-{threading.get_ident()}")
+            try:
+                tmp.write_text(json.dumps(job.to_dict(), ensure_ascii=False, default=str), encoding="utf-8")
+                os.replace(tmp, path)
+            except OSError as e:
+                log("build_job_save_error", job_id=job.id, error=str(e))
+
+    def _load(self, path: Path) -> Optional[BuildJob]:
+        try:
+            return BuildJob.from_dict(json.loads(path.read_text(encoding="utf-8")))
+        except (OSError, ValueError, KeyError):
+            return None  # fichier supprimé ou en cours de remplacement
+
+    def _prune_saved(self) -> None:
+        finished = [j for j in self._saved() if j.status not in ("queued", "running")]
+        for job in finished[self.keep:]:
+            (self.state_dir / f"{job.id}.json").unlink(missing_ok=True)
+
+    def _saved(self) -> List[BuildJob]:
+        jobs = [j for p in self.state_dir.glob("*.json") if (j := self._load(p)) is not None]
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def submit(self, full: bool = False) -> BuildJob:
+        job = BuildJob(full)
+        job.on_change = lambda j, stage: self._save(j, force=stage)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.status in ("queued", "running"):
+                    break
+                self._jobs.popitem(last=False)
+        self._save(job)
+        self._executor.submit(self._run, job)
+        log("build_job_queued", job_id=job.id, full=full)
+        return job
+
+    def _run(self, job: BuildJob) -> None:
+        request_id_var.set(job.id)  # les logs du build portent l'id du job
+        job.status, job.started_at = "running", time.time()
+        self._save(job)
+        log("build_job_started", job_id=job.id)
+        try:
+            job.result = self.build_fn(full=job.full, progress=job.on_progress)
+            if self.on_success is not None:
+                self.on_success(job.result)
+            job.status = "succeeded"
+            log("build_job_succeeded", job_id=job.id, **job.result)
+        except Exception as e:
+            job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+            log("build_job_failed", job_id=job.id, error=job.error)
+        finally:
+            job.finished_at = time.time()
+            self._save(job)
+            self._saved_at.pop(job.id, None)
+            if self.state_dir is not None:
+                self._prune_saved()
+
+    def get(self, job_id: str) -> Optional[BuildJob]:
+        job = self._jobs.get(job_id)
+        if job is None and self.state_dir is not None and job_id.isalnum():
+            job = self._load(self.state_dir / f"{job_id}.json")
+        return job
+
+    def list(self) -> List[BuildJob]:
+        if self.state_dir is not None:
+            return self._saved()[:self.keep]
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
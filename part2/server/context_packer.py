@@ -0,0 +1,102 @@
+"""
+Token-budgeted assembly of the /chat prompt.
+
+    system prompt + user_info + question   always sent
+    history                                newest turns first, up to HISTORY_MAX_TOKENS
+    KB snippets                            deduplicated by chunk id, best score first,
+                                           until CONTEXT_MAX_TOKENS is reached
+
+Snippets that do not fit are skipped whole (a smaller one further down may
+still fit); history is cut at a turn boundary, never mid-message.
+"""
+import json
+import os
+from typing import Any, Dict, List, Tuple
+
+from kb_index import count_tokens
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "1500"))
+MESSAGE_OVERHEAD_TOKENS = 4  # rôle + séparateurs du format chat
+SNIPPET_OVERHEAD_TOKENS = 2  # guillemets et virgule dans la liste JSON
+
+
+def dedupe_hits(hits: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """One hit per chunk id (the best-scored one), ordered by descending score."""
+    best: Dict[Any, Dict[str, Any]] = {}
+    for h in hits:
+        cid = h.get("chunk_id", id(h))
+        if cid not in best or h.get("score", 0.0) > best[cid].get("score", 0.0):
+            best[cid] = h
+    ranked = sorted(best.values(), key=lambda h: -h.get("score", 0.0))
+    return ranked, len(hits) - len(ranked)
+
+
+def snippet_text(hit: Dict[str, Any]) -> str:
+    # Add context to each snippet if available
+    context = hit.get("context")
+    return f"{context}\n{hit['content']}" if context else hit["content"]
+
+
+def _trim_history(history: List[Dict[str, str]], budget: int) -> Tuple[List[Dict[str, str]], int]:
+    kept: List[Dict[str, str]] = []
+    used = 0
+    for m in reversed(history):
+        n = count_tokens(m["content"]) + MESSAGE_OVERHEAD_TOKENS
+        if used + n > budget:
+            break
+        kept.append(m)
+        used += n
+    kept.reverse()
+    return kept, used
+
+
+def pack_context(
+    system_prompt: str,
+    payload: Dict[str, Any],
+    history: List[Dict[str, str]],
+    hits: List[Dict[str, Any]],
+    max_tokens: int = CONTEXT_MAX_TOKENS,
+    history_max_tokens: int = HISTORY_MAX_TOKENS,
+) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+    """
+    Build the chat messages for `payload` (lang, user_info, question) with as
+    much history and as many KB snippets as the budget allows.
+    Returns (messages, token counts per section for logging).
+    """
+    fixed = (
+        count_tokens(system_prompt)
+        + count_tokens(json.dumps({**payload, "kb_snippets": []}, ensure_ascii=False))
+        + 2 * MESSAGE_OVERHEAD_TOKENS
+    )
+    kept_history, history_tokens = _trim_history(history, max(0, min(history_max_tokens, max_tokens - fixed)))
+
+    ranked, duplicates = dedupe_hits(hits)
+    room = max_tokens - fixed - history_tokens
+    snippets: List[str] = []
+    snippet_tokens = 0
+    for h in ranked:
+        text = snippet_text(h)
+        n = count_tokens(text) + SNIPPET_OVERHEAD_TOKENS
+        if snippet_tokens + n > room:
+            continue
+        snippets.append(text)
+        snippet_tokens += n
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        *kept_history,
+        {"role": "user", "content": json.dumps({**payload, "kb_snippets": snippets}, ensure_ascii=False)},
+    ]
+    stats = {
+        "fixed_tokens": fixed,
+        "history_tokens": history_tokens,
+        "history_messages": len(kept_history),
+        "history_dropped": len(history) - len(kept_history),
+        "snippet_tokens": snippet_tokens,
+        "snippets": len(snippets),
+        "snippets_dropped": len(ranked) - len(snippets),
+        "duplicates": duplicates,
+        "total_tokens": fixed + history_tokens + snippet_tokens,
+    }
+    return messages, stats
@@ -0,0 +1,105 @@
+"""
+CPU-local embedding providers (kb_index.embedder picks one from EMB_PROVIDER):
+
+    local     sentence-embedding model exported to ONNX, run by onnxruntime.
+              EMB_LOCAL_MODEL_PATH is a directory with model.onnx and the
+              tokenizer.json of the same model (e.g. a MiniLM / e5-small export).
+    hashing   signed feature hashing of the lexical tokens and their character
+              trigrams. No model and no dependency: deterministic vectors for
+              tests, offline benchmarks and a lexical-only fallback.
+
+Every provider has a `name` and a `key` (the exact model, part of the chunk
+and query-cache keys) that are written to the index manifest with the vector
+dimension; an index built by another provider is refused at load time.
+"""
+import os
+import zlib
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from lexical import tokenize
+
+EMB_LOCAL_MODEL_PATH = os.getenv("EMB_LOCAL_MODEL_PATH", "")
+EMB_LOCAL_MAX_LENGTH = int(os.getenv("EMB_LOCAL_MAX_LENGTH", "256"))
+EMB_LOCAL_THREADS = int(os.getenv("EMB_LOCAL_THREADS", "0"))  # 0 = choix d'onnxruntime
+EMB_HASH_DIM = int(os.getenv("EMB_HASH_DIM", "1024"))
+
+
+class Embedder:
+    name = ""
+    key = ""
+    dim: Optional[int] = None  # None tant que le modèle ne l'a pas révélé
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), dim) float32 embeddings, not necessarily normalized."""
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    name = "hashing"
+
+    def __init__(self, dim: int = EMB_HASH_DIM):
+        self.dim = dim
+        self.key = f"hashing-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        feats: List[str] = []
+        for tok in tokenize(text):
+            feats.append(tok)
+            padded = f"<{tok}>"
+            feats.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+        return feats
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            h = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in self._features(text)), dtype=np.uint32)
+            if len(h):
+                # bit de poids fort = signe: les collisions s'annulent en moyenne
+                signs = np.where(h >> 31, -1.0, 1.0).astype("float32")
+                np.add.at(out[row], (h % self.dim).astype(np.int64), signs)
+        return out
+
+
+class OnnxEmbedder(Embedder):
+    name = "local"
+
+    def __init__(self, path: str = EMB_LOCAL_MODEL_PATH, max_length: int = EMB_LOCAL_MAX_LENGTH,
+                 threads: int = EMB_LOCAL_THREADS):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise RuntimeError("EMB_PROVIDER=local needs `pip install onnxruntime tokenizers`.") from e
+        model_dir = Path(path)
+        if not path or not (model_dir / "model.onnx").exists() or not (model_dir / "tokenizer.json").exists():
+            raise RuntimeError(f"EMB_LOCAL_MODEL_PATH '{path}' must contain model.onnx and tokenizer.json.")
+
+        self.key = f"local-{model_dir.resolve().name}"
+        self._tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length)
+        self._tokenizer.enable_padding()
+        opts = ort.SessionOptions()
+        if threads:
+            opts.intra_op_num_threads = threads
+        self._session = ort.InferenceSession(str(model_dir / "model.onnx"), opts, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self._session.get_inputs()}
+        out_dim = self._session.get_outputs()[0].shape[-1]
+        self.dim = out_dim if isinstance(out_dim, int) else None
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        enc = self._tokenizer.encode_batch(texts)
+        ids = np.array([e.ids for e in enc], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in enc], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+        out = self._session.run(None, feeds)[0]
+        if out.ndim == 3:
+            # Mean pooling sur les tokens réels (sortie last_hidden_state)
+            m = mask[..., None].astype("float32")
+            out = (out * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1.0)
+        self.dim = out.shape[1]
+        return out.astype("float32", copy=False)
@@ -0,0 +1,263 @@
+"""
+Versioned on-disk format for one language's KB index.
+
+    <index_dir>/CURRENT              name of the live generation (swapped atomically)
+    <index_dir>/gen-000007/
+        manifest.json                format_version, rows, dim, dtype, deployment, file/chunk hashes
+        vectors.npy                  row-normalized vectors: float32 | float16 | int8
+        scales.npy                   float32 per-row dequantization scale (int8 only)
+        columns.npy                  int32 (rows, len(COLUMNS)) codes into strings.json, -1 = None
+        <extra>.npy                  optional arrays listed in manifest["extra_arrays"] (ANN lists)
+        strings.json                 string table shared by every column
+        content.bin                  utf-8 contents, concatenated
+        content_offsets.npy          int64 (rows + 1) byte offsets into content.bin
+
+Every array is loaded with mmap, so opening a generation costs one small JSON
+parse (the string table) regardless of the number of rows.
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 2
+VECTOR_DTYPES = ("int8", "float16", "float32")  # par précision croissante
+COLUMNS = ("source", "type", "title", "subtitle", "context", "service_name", "hmo_name", "level")
+CTX_KEYS = ("service_name", "hmo_name", "level")
+NONE = -1
+CTX_DICT = -2  # le contexte est le dict {service_name, hmo_name, level} des colonnes voisines
+KEEP_GENERATIONS = int(os.getenv("INDEX_KEEP_GENERATIONS", "2"))
+
+
+# === Quantization ============================================================
+def quantize(vecs: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Return (stored vectors, per-row scales or None) for a normalized float32 matrix."""
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unsupported vector dtype '{dtype}' (expected one of {VECTOR_DTYPES}).")
+    vecs = np.asarray(vecs, dtype="float32")
+    if dtype == "float32":
+        return vecs, None
+    if dtype == "float16":
+        return vecs.astype("float16"), None
+    scales = np.abs(vecs).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(vecs / scales[:, None]), -127, 127).astype("int8")
+    return q, scales.astype("float32")
+
+
+def dequantize(vecs: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    out = np.asarray(vecs, dtype="float32")
+    if scales is not None:
+        out = out * np.asarray(scales, dtype="float32")[:, None]
+    return out
+
+
+def can_reuse(stored_dtype: str, target_dtype: str) -> bool:
+    """Vectors stored at `stored_dtype` can be re-stored at `target_dtype` without re-embedding."""
+    return VECTOR_DTYPES.index(stored_dtype) >= VECTOR_DTYPES.index(target_dtype)
+
+
+# === Columnar metadata =======================================================
+class ColumnarMeta(Sequence):
+    """
+    Read-only sequence of meta dicts backed by the mmap'd columns; a dict is
+    only materialized for the rows that are actually accessed (search hits).
+    """
+
+    def __init__(self, columns: np.ndarray, strings: List[str], content: np.ndarray, offsets: np.ndarray):
+        self.columns = columns
+        self.strings = strings
+        self.content = content
+        self.offsets = offsets
+        self._col = {name: i for i, name in enumerate(COLUMNS)}
+        self._codes = {s: i for i, s in enumerate(strings)}
+
+    def __len__(self) -> int:
+        return self.columns.shape[0]
+
+    def column(self, name: str) -> np.ndarray:
+        return self.columns[:, self._col[name]]
+
+    def code(self, value: str) -> int:
+        return self._codes.get(value, NONE)
+
+    def decode(self, code: int) -> Optional[str]:
+        return None if code < 0 else self.strings[code]
+
+    def content_at(self, i: int) -> str:
+        return bytes(self.content[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        row = self.columns[i]
+        c = self._col
+        ctx_code = int(row[c["context"]])
+        if ctx_code == CTX_DICT:
+            context: Any = {k: self.decode(int(row[c[k]])) for k in CTX_KEYS}
+        else:
+            context = self.decode(ctx_code)
+        return {
+            "source": self.decode(int(row[c["source"]])),
+            "type": self.decode(int(row[c["type"]])),
+            "title": self.decode(int(row[c["title"]])),
+            "subtitle": self.decode(int(row[c["subtitle"]])),
+            "content": self.content_at(i),
+            "context": context,
+        }
+
+
+def _encode_meta(entries: List[Dict[str, Any]]) -> Tuple[np.ndarray, List[str], bytes, np.ndarray]:
+    strings: List[str] = []
+    codes: Dict[str, int] = {}
+
+    def enc(v: Optional[str]) -> int:
+        if v is None:
+            return NONE
+        v = str(v)
+        if v not in codes:
+            codes[v] = len(strings)
+            strings.append(v)
+        return codes[v]
+
+    columns = np.full((len(entries), len(COLUMNS)), NONE, dtype=np.int32)
+    blobs: List[bytes] = []
+    offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+    for i, e in enumerate(entries):
+        ctx = e.get("context")
+        if isinstance(ctx, dict):
+            if set(ctx) - set(CTX_KEYS):
+                raise ValueError(f"Unsupported context keys {sorted(ctx)} (expected {CTX_KEYS}).")
+            ctx_code = CTX_DICT
+        else:
+            ctx_code = enc(ctx)
+            ctx = {}
+        columns[i] = (
+            enc(e.get("source")), enc(e.get("type")), enc(e.get("title")), enc(e.get("subtitle")),
+            ctx_code, enc(ctx.get("service_name")), enc(ctx.get("hmo_name")), enc(ctx.get("level")),
+        )
+        blob = (e.get("content") or "").encode("utf-8")
+        blobs.append(blob)
+        offsets[i + 1] = offsets[i] + len(blob)
+    return columns, strings, b"".join(blobs), offsets
+
+
+# === Read / write ============================================================
+class StoredIndex:
+    def __init__(self, path: Path, manifest: Dict[str, Any], vecs: np.ndarray, scales: Optional[np.ndarray],
+                 meta: ColumnarMeta, extras: Optional[Dict[str, np.ndarray]] = None):
+        self.path = path
+        self.manifest = manifest
+        self.vecs = vecs
+        self.scales = scales
+        self.meta = meta
+        self.extras = extras or {}
+
+
+def current_dir(index_dir: Path) -> Optional[Path]:
+    try:
+        name = (index_dir / "CURRENT").read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    return index_dir / name if name else None
+
+
+def read_manifest(index_dir: Path) -> Dict[str, Any]:
+    gen = current_dir(index_dir)
+    if gen is None:
+        return {}
+    try:
+        return json.loads((gen / "manifest.json").read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def read_index(gen_dir: Path) -> StoredIndex:
+    manifest = json.loads((gen_dir / "manifest.json").read_text(encoding="utf-8"))
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise RuntimeError(f"Unsupported index format {manifest.get('format_version')} in {gen_dir}.")
+    vecs = np.load(gen_dir / "vectors.npy", mmap_mode="r")
+    scales = np.load(gen_dir / "scales.npy", mmap_mode="r") if manifest["dtype"] == "int8" else None
+    columns = np.load(gen_dir / "columns.npy", mmap_mode="r")
+    offsets = np.load(gen_dir / "content_offsets.npy", mmap_mode="r")
+    content_path = gen_dir / "content.bin"
+    content = (
+        np.memmap(content_path, dtype=np.uint8, mode="r")
+        if content_path.stat().st_size else np.zeros(0, dtype=np.uint8)
+    )
+    strings = json.loads((gen_dir / "strings.json").read_text(encoding="utf-8"))
+    if vecs.shape[0] != manifest["rows"] or columns.shape[0] != manifest["rows"]:
+        raise RuntimeError(f"Index generation {gen_dir} is inconsistent with its manifest.")
+    extras = {name: np.load(gen_dir / f"{name}.npy", mmap_mode="r") for name in manifest.get("extra_arrays", [])}
+    return StoredIndex(gen_dir, manifest, vecs, scales, ColumnarMeta(columns, strings, content, offsets), extras)
+
+
+def write_generation(
+    index_dir: Path,
+    vecs: np.ndarray,
+    entries: List[Dict[str, Any]],
+    manifest: Dict[str, Any],
+    dtype: str = "float32",
+    extra_arrays: Optional[Dict[str, np.ndarray]] = None,
+    publish: bool = True,
+) -> Path:
+    """
+    Write a complete generation next to the live one, then point CURRENT at it
+    (unless `publish` is False: the caller swaps it later with publish_generation).
+    `extra_arrays` (e.g. the ANN lists) are saved as <name>.npy and mmap'd on read.
+    Readers holding the previous generation keep their mmaps until they drop them.
+    """
+    index_dir.mkdir(parents=True, exist_ok=True)
+    name = f"gen-{int(manifest['generation']):06d}"
+    final = index_dir / name
+    tmp = index_dir / f".{name}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+
+    stored, scales = quantize(vecs, dtype)
+    columns, strings, content, offsets = _encode_meta(entries)
+    np.save(tmp / "vectors.npy", stored)
+    if scales is not None:
+        np.save(tmp / "scales.npy", scales)
+    np.save(tmp / "columns.npy", columns)
+    np.save(tmp / "content_offsets.npy", offsets)
+    (tmp / "content.bin").write_bytes(content)
+    (tmp / "strings.json").write_text(json.dumps(strings, ensure_ascii=False), encoding="utf-8")
+    for array_name, arr in (extra_arrays or {}).items():
+        np.save(tmp / f"{array_name}.npy", arr)
+    (tmp / "manifest.json").write_text(json.dumps({
+        **manifest,
+        "format_version": FORMAT_VERSION,
+        "rows": int(stored.shape[0]),
+        "dim": int(stored.shape[1]) if stored.ndim == 2 else 0,
+        "dtype": dtype,
+        "columns": list(COLUMNS),
+        "extra_arrays": sorted(extra_arrays or {}),
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    shutil.rmtree(final, ignore_errors=True)
+    os.replace(tmp, final)
+    if publish:
+        publish_generation(final)
+    return final
+
+
+def publish_generation(gen_dir: Path) -> None:
+    """Atomically point <index_dir>/CURRENT at an already written generation."""
+    index_dir, name = gen_dir.parent, gen_dir.name
+    pointer = index_dir / f".CURRENT.tmp-{os.getpid()}"
+    pointer.write_text(name, encoding="utf-8")
+    os.replace(pointer, index_dir / "CURRENT")
+    _prune(index_dir, keep=name)
+
+
+def _prune(index_dir: Path, keep: str) -> None:
+    gens = sorted(p for p in index_dir.glob("gen-*") if p.is_dir())
+    for old in gens[:-KEEP_GENERATIONS] if KEEP_GENERATIONS > 0 else []:
+        if old.name != keep:
+            shutil.rmtree(old, ignore_errors=True)
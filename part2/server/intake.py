@@ -0,0 +1,199 @@
+"""
+Rule-based fast path for /collect.
+
+Most intake turns answer the question just asked with a single well-formed
+value ("123456789", "Maccabi", "34", "זהב"). For those, the field being
+asked is recognized from the previous assistant message, the answer is
+parsed and validated like UserInfo does, and the next CollectResponse is
+built from templated Hebrew / English messages, without an LLM call.
+
+Anything else (names, greetings, corrections, several fields in one message,
+a "no" to the summary) returns None and /collect falls back to the LLM.
+"""
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from models import CollectRequest, CollectResponse, UserInfo
+
+INTAKE_RULES = os.getenv("INTAKE_RULES", "1") not in ("0", "false", "off")
+
+FIELDS = ["firstName", "lastName", "id", "gender", "age", "hmo", "hmoCard", "tier"]
+RULE_FIELDS = ("id", "hmoCard", "age", "hmo", "tier", "gender")
+
+HMO_NAMES = {"מכבי": ("מכבי", "Maccabi"), "מאוחדת": ("מאוחדת", "Meuhedet"), "כללית": ("כללית", "Clalit")}
+HMO_ALIASES = {
+    "מכבי": "מכבי", "maccabi": "מכבי", "macabi": "מכבי", "makabi": "מכבי",
+    "מאוחדת": "מאוחדת", "meuhedet": "מאוחדת", "meuchedet": "מאוחדת", "meuhedeth": "מאוחדת",
+    "כללית": "כללית", "clalit": "כללית", "klalit": "כללית",
+}
+TIER_NAMES = {"זהב": ("זהב", "Gold"), "כסף": ("כסף", "Silver"), "ארד": ("ארד", "Bronze")}
+TIER_ALIASES = {"זהב": "זהב", "gold": "זהב", "כסף": "כסף", "silver": "כסף", "ארד": "ארד", "bronze": "ארד"}
+GENDER_NAMES = {"male": ("זכר", "male"), "female": ("נקבה", "female")}
+GENDER_ALIASES = {
+    "male": "male", "m": "male", "man": "male", "זכר": "male", "גבר": "male", "ז": "male",
+    "female": "female", "f": "female", "woman": "female", "נקבה": "female", "אישה": "female", "אשה": "female", "נ": "female",
+}
+YES = frozenset("yes y yeah yep yup correct confirm confirmed ok okay sure right כן נכון מאשר מאשרת מאושר בטח סבבה אכן".split())
+
+# Mots qui désignent chaque champ dans la question de l'assistant (templates ci-dessous ou LLM)
+_HE_PREFIX = "[והבכלמש]?"
+FIELD_PATTERNS = {
+    "firstName": [r"\bfirst name\b", "שם פרטי", "שם הפרטי", "שמך הפרטי"],
+    "lastName": [r"\blast name\b", r"\bsurname\b", r"\bfamily name\b", "שם משפחה", "שם המשפחה"],
+    "id": [r"\bID\b", r"\bidentity\b", r"\bI\.D\.", "תעודת זהות", "תעודת הזהות", "ת\\.ז", "ת\"ז", r"ת״ז", r"\bתז\b"],
+    "gender": [r"\bgender\b", r"\bsex\b", "מגדר", r"\bמין\b"],
+    "age": [r"\bage\b", r"\bhow old\b", "גיל", "בן כמה", "בת כמה"],
+    "hmo": [r"\bHMO\b", r"\bhealth fund\b", r"\bkupat holim\b", "קופת חולים", "קופת החולים", r"\bקופה\b", "קופ\"ח"],
+    "hmoCard": [r"\bcard\b", "כרטיס"],
+    "tier": [r"\btier\b", r"\bmembership level\b", "מסלול", "רובד"],
+}
+# Un champ plus précis l'emporte: "HMO card number" -> hmoCard, "HMO membership tier" -> tier
+PRECEDENCE = {"hmoCard": ("hmo",), "tier": ("hmo",)}
+
+
+def _compile(pattern: str) -> "re.Pattern[str]":
+    if re.search("[א-ת]", pattern) and not pattern.startswith(r"\b"):
+        # Hébreu: préfixe d'une lettre accepté, mot non collé à d'autres lettres
+        return re.compile(rf"(?<![\w]){_HE_PREFIX}{pattern}")
+    return re.compile(pattern, re.IGNORECASE)
+
+
+_FIELD_RES = {f: [_compile(p) for p in pats] for f, pats in FIELD_PATTERNS.items()}
+_CONFIRM_RE = re.compile(r"\bcorrect\b|\bconfirm|נכון|לאשר|מאשר", re.IGNORECASE)
+_HEBREW = re.compile("[א-ת]")
+_LATIN = re.compile("[A-Za-z]")
+
+LABELS = {
+    "en": {
+        "firstName": "first name", "lastName": "last name", "id": "ID number (9 digits)", "gender": "gender",
+        "age": "age", "hmo": "HMO (Maccabi, Meuhedet or Clalit)", "hmoCard": "HMO card number (9 digits)",
+        "tier": "membership tier (Gold, Silver or Bronze)",
+    },
+    "he": {
+        "firstName": "השם הפרטי", "lastName": "שם המשפחה", "id": "מספר תעודת הזהות (9 ספרות)", "gender": "המגדר",
+        "age": "הגיל", "hmo": "קופת החולים (מכבי, מאוחדת או כללית)", "hmoCard": "מספר כרטיס קופת החולים (9 ספרות)",
+        "tier": "מסלול החברות (זהב, כסף או ארד)",
+    },
+}
+TEMPLATES = {
+    "en": {
+        "ask": "Thank you! Could you please tell me your {label}?",
+        "invalid": "Hmm, that doesn't look like a valid {label}. Could you check it again for me?",
+        "confirm": ("Great, here is what I have: {firstName} {lastName}, ID {id}, {gender}, age {age}, "
+                    "{hmo} card {hmoCard}, {tier} tier. Is everything correct? (yes/no)"),
+        "done": "Wonderful, you're all set! You can now ask about your HMO benefits and services in the Q&A tab.",
+    },
+    "he": {
+        "ask": "תודה! מה {label} שלך?",
+        "invalid": "נראה ש{label} אינו תקין. אפשר לבדוק ולהקליד שוב?",
+        "confirm": ("מעולה, אלה הפרטים שלך: {firstName} {lastName}, ת.ז. {id}, {gender}, גיל {age}, "
+                    "{hmo}, כרטיס {hmoCard}, מסלול {tier}. האם הכול נכון? (כן/לא)"),
+        "done": "נהדר, סיימנו! עכשיו אפשר לשאול על ההטבות והשירותים של קופת החולים בלשונית השאלות.",
+    },
+}
+
+
+def detect_lang(text: str, default: str) -> str:
+    if _HEBREW.search(text):
+        return "he"
+    if _LATIN.search(text):
+        return "en"
+    return default
+
+
+def _words(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", text.casefold()).split())
+
+
+def is_valid(field: str, info: UserInfo) -> bool:
+    value = getattr(info, field)
+    if field in ("id", "hmoCard"):
+        return bool(re.fullmatch(r"\d{9}", value))
+    if field == "age":
+        return 1 <= int(value or 0) <= 120
+    if field == "hmo":
+        return _words(value) in HMO_ALIASES
+    if field == "tier":
+        return _words(value) in TIER_ALIASES
+    return bool(str(value).strip())
+
+
+def missing_fields(info: UserInfo) -> List[str]:
+    return [f for f in FIELDS if not is_valid(f, info)]
+
+
+def asked_field(message: str) -> Optional[str]:
+    """The single field the assistant message asks for, or None if none / several."""
+    found = {f for f, regs in _FIELD_RES.items() if any(r.search(message) for r in regs)}
+    for field, beaten in PRECEDENCE.items():
+        if field in found:
+            found -= set(beaten)
+    return found.pop() if len(found) == 1 else None
+
+
+def parse_answer(field: str, text: str, lang: str) -> Optional[Tuple[Any, bool]]:
+    """(value, valid) for a single-value answer to `field`; None when the text is not one."""
+    raw = text.strip()
+    if field in ("id", "hmoCard"):
+        digits = re.sub(r"[\s\-.]", "", raw)
+        if not digits.isdigit():
+            return None
+        return digits, len(digits) == 9
+    if field == "age":
+        m = re.fullmatch(r"(?:(?:i ?m|i am|age|בן|בת|גיל)\s+)?(\d{1,3})(?:\s*(?:years? old|years?|yo|שנים|שנה))?", _words(raw))
+        if m is None:
+            return None
+        age = int(m.group(1))
+        return age, 1 <= age <= 120
+    words = _words(raw)
+    if field == "hmo":
+        words = re.sub(r"^(?:קופת חולים|קופת|קופ ח|kupat holim|the)\s+", "", words)
+        canon = HMO_ALIASES.get(words)
+        return None if canon is None else (HMO_NAMES[canon][lang == "en"], True)
+    if field == "tier":
+        words = re.sub(r"^(?:מסלול|רובד|tier|level)\s+|\s+(?:tier|level)$", "", words)
+        canon = TIER_ALIASES.get(words)
+        return None if canon is None else (TIER_NAMES[canon][lang == "en"], True)
+    if field == "gender":
+        canon = GENDER_ALIASES.get(words)
+        return None if canon is None else (GENDER_NAMES[canon][lang == "en"], True)
+    return None
+
+
+def _ask(field: str, lang: str, invalid: bool = False) -> str:
+    return TEMPLATES[lang]["invalid" if invalid else "ask"].format(label=LABELS[lang][field])
+
+
+def fast_reply(req: CollectRequest) -> Optional[CollectResponse]:
+    """Next CollectResponse computed without the LLM, or None when the turn needs it."""
+    history = req.history
+    if len(history) < 2 or history[-1].role != "user" or history[-2].role != "assistant":
+        return None  # premier tour (salutations) ou tours consécutifs: au LLM
+    answer, question = history[-1].content, history[-2].content
+    lang = detect_lang(answer, detect_lang(question, req.lang))  # "123456789": langue de la question
+    info = req.user_info.model_copy()
+    missing = missing_fields(info)
+
+    if not missing:
+        if _CONFIRM_RE.search(question) and _words(answer) in YES:
+            return CollectResponse(phase="DONE", message=TEMPLATES[lang]["done"], missing=[], userinfo=info, lang=lang)
+        return None
+
+    field = asked_field(question)
+    if field not in RULE_FIELDS:
+        return None
+    parsed = parse_answer(field, answer, lang)
+    if parsed is None:
+        return None
+    value, valid = parsed
+    if not valid:
+        missing = [field] + [f for f in missing if f != field]
+        return CollectResponse(phase="ASK", message=_ask(field, lang, invalid=True), missing=missing, userinfo=info, lang=lang)
+
+    info = UserInfo(**{**info.model_dump(), field: value})
+    missing = missing_fields(info)
+    if missing:
+        return CollectResponse(phase="ASK", message=_ask(missing[0], lang), missing=missing, userinfo=info, lang=lang)
+    summary: Dict[str, Any] = info.model_dump()
+    return CollectResponse(phase="CONFIRM", message=TEMPLATES[lang]["confirm"].format(**summary), missing=[], userinfo=info, lang=lang)
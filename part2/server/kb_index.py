@@ -1,14 +1,46 @@
 import os
 import json
 import re
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Union, Callable
+
+try:
+    import fcntl
+except ImportError:  # Windows: pas de verrou inter-processus
+    fcntl = None
 
 from bs4 import BeautifulSoup
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AzureOpenAI, APIConnectionError, APIStatusError, RateLimitError
+
+from vector_search import cosine_scores, l2_normalize, is_normalized, search as knn_search, top_k_in
+from index_store import (
+    FORMAT_VERSION,
+    ColumnarMeta,
+    StoredIndex,
+    can_reuse,
+    current_dir,
+    dequantize,
+    publish_generation,
+    read_index,
+    read_manifest,
+    write_generation,
+)
+from ann import IVFIndex, default_nlist, train_ivf
+from lexical import BM25Index, build_bm25, rrf_fuse
+from embedders import Embedder, HashingEmbedder, OnnxEmbedder
+from logger import log
+from metrics import span
 
 # === Config & Client =========================================================
 load_dotenv()
@@ -17,6 +49,7 @@ AOAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AOAI_KEY = os.getenv("AZURE_OPENAI_API_KEY")
 AOAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview")
 EMB_DEPLOYMENT = os.getenv("AZURE_OPENAI_EMBED_DEPLOYMENT", "text-embedding-ada-002")
+EMB_PROVIDER = os.getenv("EMB_PROVIDER", "azure")  # azure | local | hashing
 CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o")
 PHASE2_DATA_DIR = Path(os.getenv("PHASE2_DATA_DIR", "./phase2_data"))
 INDEX_DIR = Path(os.getenv("INDEX_DIR", "./kb_index"))
@@ -31,17 +64,6 @@ client = AzureOpenAI(
 
 
 
-# === Canon Tier (pour boost de recherche) ====================================
-TIER_CANON = {
-    "זהב": "זהב", "gold": "זהב", "Gold": "זהב",
-    "כסף": "כסף", "silver": "כסף", "Silver": "כסף",
-    "ארד": "ארד", "bronze": "ארד", "Bronze": "ארד",
-}
-def canon_tier(x: Optional[str]) -> str:
-    if not x:
-        return ""
-    return TIER_CANON.get(x, x)
-
 # === Helpers =================================================================
 def parse_html(path: Path) -> List[Dict[str, Any]]:
     try:
@@ -137,13 +159,258 @@ def parse_html(path: Path) -> List[Dict[str, Any]]:
         print(f"Error parsing HTML {path}: {e}")
         return []
 
-def embed_texts(texts: List[str]) -> np.ndarray:
-    """Create embeddings for a list of strings using Azure OpenAI embeddings."""
+def _atomic_write_text(path: Path, text: str) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(text, encoding="utf-8")
+    os.replace(tmp, path)
+
+# === Embeddings ==============================================================
+EMB_BATCH_MAX_TOKENS = int(os.getenv("EMB_BATCH_MAX_TOKENS", "100000"))
+EMB_BATCH_MAX_INPUTS = int(os.getenv("EMB_BATCH_MAX_INPUTS", "256"))
+EMB_MAX_INPUT_TOKENS = int(os.getenv("EMB_MAX_INPUT_TOKENS", "8191"))
+EMB_CONCURRENCY = int(os.getenv("EMB_CONCURRENCY", "4"))
+EMB_MAX_RETRIES = int(os.getenv("EMB_MAX_RETRIES", "6"))
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    _encoding = False  # pas de BPE local (offline): borne supérieure en octets
+    return _encoding or None
+
+
+def count_tokens(text: str) -> int:
+    """Token count with cl100k_base, or the UTF-8 byte length (an upper bound) if unavailable."""
+    enc = _get_encoding()
+    if enc is None:
+        return len(text.encode("utf-8"))
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def _truncate_tokens(text: str, max_tokens: int) -> str:
+    enc = _get_encoding()
+    if enc is None:
+        return text.encode("utf-8")[:max_tokens].decode("utf-8", errors="ignore")
+    toks = enc.encode(text, disallowed_special=())
+    return text if len(toks) <= max_tokens else enc.decode(toks[:max_tokens])
+
+
+def _pack_batches(token_counts: List[int], max_tokens: int, max_inputs: int) -> List[Tuple[int, int]]:
+    """Split inputs into contiguous [start, end) ranges bounded by token and input counts."""
+    batches: List[Tuple[int, int]] = []
+    start, used = 0, 0
+    for i, n in enumerate(token_counts):
+        if i > start and (used + n > max_tokens or i - start >= max_inputs):
+            batches.append((start, i))
+            start, used = i, 0
+        used += n
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+
+def _retry_delay(err: Exception, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying `err`, or None if it is not retryable."""
+    if isinstance(err, (RateLimitError, APIConnectionError)):
+        pass
+    elif isinstance(err, APIStatusError) and err.status_code >= 500:
+        pass
+    else:
+        return None
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return min(float(retry_after), 60.0)
+        except ValueError:
+            pass
+    return min(2 ** attempt, 30.0) * (0.5 + random.random())
+
+
+class AzureEmbedder(Embedder):
+    """Azure OpenAI embeddings deployment, with its own retry / backoff on 429 and 5xx."""
+
+    name = "azure"
+
+    def __init__(self, deployment: str = EMB_DEPLOYMENT):
+        self.key = deployment  # clé historique des chunks et du cache de requêtes
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        api = client.with_options(max_retries=0)  # les retries sont gérés ici
+        for attempt in range(EMB_MAX_RETRIES + 1):
+            try:
+                resp = api.embeddings.create(model=self.key, input=texts)
+                data = sorted(resp.data, key=lambda d: d.index)
+                vecs = np.array([d.embedding for d in data], dtype="float32")
+                self.dim = vecs.shape[1]
+                return vecs
+            except Exception as e:
+                delay = _retry_delay(e, attempt)
+                if delay is None or attempt == EMB_MAX_RETRIES:
+                    raise
+                log("embed_retry", attempt=attempt + 1, delay=round(delay, 2), error=str(e))
+                time.sleep(delay)
+        raise AssertionError("unreachable")
+
+
+def make_embedder(provider: str = EMB_PROVIDER) -> Embedder:
+    if provider == "azure":
+        return AzureEmbedder()
+    if provider == "local":
+        return OnnxEmbedder()
+    if provider == "hashing":
+        return HashingEmbedder()
+    raise ValueError(f"Unknown EMB_PROVIDER '{provider}' (expected azure | local | hashing).")
+
+
+embedder = make_embedder()
+
+
+def _embed_batch(texts: List[str]) -> np.ndarray:
+    return embedder.embed(texts)
+
+
+def embed_texts(texts: List[str], normalize: bool = False) -> np.ndarray:
+    """
+    Create embeddings for a list of strings with the configured provider.
+    Inputs are packed into token-bounded batches sent EMB_CONCURRENCY at a time;
+    each batch is written into one preallocated float32 array, in input order.
+    """
     if not texts:
-        return np.zeros((0, 1536), dtype="float32")  # ada dims; safe default
-    resp = client.embeddings.create(model=EMB_DEPLOYMENT, input=texts)
-    vecs = [d.embedding for d in resp.data]
-    return np.array(vecs, dtype="float32")
+        return np.zeros((0, embedder.dim or 1536), dtype="float32")  # ada dims tant que la dimension est inconnue
+    texts = [_truncate_tokens(t, EMB_MAX_INPUT_TOKENS) or " " for t in texts]
+    batches = _pack_batches([count_tokens(t) for t in texts], EMB_BATCH_MAX_TOKENS, EMB_BATCH_MAX_INPUTS)
+
+    out: Optional[np.ndarray] = None
+
+    def _store(bounds: Tuple[int, int], vecs: np.ndarray) -> None:
+        nonlocal out
+        if out is None:
+            out = np.empty((len(texts), vecs.shape[1]), dtype="float32")
+        out[bounds[0]:bounds[1]] = l2_normalize(vecs) if normalize else vecs
+
+    if len(batches) == 1:
+        _store(batches[0], _embed_batch(texts))
+        return out
+
+    with ThreadPoolExecutor(max_workers=max(1, EMB_CONCURRENCY)) as pool:
+        futures = {pool.submit(_embed_batch, texts[a:b]): (a, b) for a, b in batches}
+        for done, fut in enumerate(as_completed(futures), start=1):
+            _store(futures[fut], fut.result())
+            if len(batches) > 4:
+                log("embed_progress", batches_done=done, batches=len(batches))
+    return out
+
+
+# === Query embedding cache ===================================================
+EMB_CACHE_SIZE = int(os.getenv("EMB_CACHE_SIZE", "2048"))
+EMB_CACHE_PATH = os.getenv("EMB_CACHE_PATH", "")  # vide = mémoire seulement
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split()).casefold()
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU of query embeddings keyed by (embedder key, normalized text),
+    with an optional SQLite tier that survives restarts.
+    """
+
+    def __init__(self, max_items: int = EMB_CACHE_SIZE, path: str = EMB_CACHE_PATH):
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._mem: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS emb (key TEXT PRIMARY KEY, vec BLOB NOT NULL)")
+            self._db.commit()
+
+    @staticmethod
+    def key(text: str, deployment: Optional[str] = None) -> str:
+        raw = f"{deployment or embedder.key}\x00{normalize_query(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._mem.get(key)
+            if vec is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return vec
+            if self._db is not None:
+                row = self._db.execute("SELECT vec FROM emb WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vec = np.frombuffer(row[0], dtype="float32")
+                    self._put_mem(key, vec)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vec
+            self.misses += 1
+            return None
+
+    def peek(self, key: str) -> Optional[np.ndarray]:
+        """In-memory lookup that neither refreshes the entry nor counts towards the stats."""
+        with self._lock:
+            return self._mem.get(key)
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        vec = np.asarray(vec, dtype="float32").copy()
+        vec.flags.writeable = False
+        with self._lock:
+            self._put_mem(key, vec)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO emb (key, vec) VALUES (?, ?)", (key, vec.tobytes()))
+                self._db.commit()
+
+    def _put_mem(self, key: str, vec: np.ndarray) -> None:
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "size": len(self._mem),
+            "hit_rate": (self.hits / total) if total else 0.0,
+        }
+
+
+embedding_cache = EmbeddingCache()
+
+
+def embed_query(text: str) -> np.ndarray:
+    """Embed a single query string, going through the cache first."""
+    key = EmbeddingCache.key(text)
+    vec = embedding_cache.get(key)
+    if vec is None:
+        with span("embed", embedder.key):
+            vec = embed_texts([text])[0]
+        embedding_cache.put(key, vec)
+    return vec
+
+
+def cached_query_embedding(text: str) -> Optional[np.ndarray]:
+    """The query's embedding if a search already computed it, without calling the API."""
+    return embedding_cache.peek(EmbeddingCache.key(text))
 
 
 # === Build / Load Index ======================================================
@@ -166,119 +433,355 @@ def translate_file(file_path: Path, target_language: str = "en") -> str:
         print(f"Error translating file {file_path}: {e}")
         return content  # Fallback to original content on error
 
-def build_index_with_translated_files() -> Dict[str, Any]:
+def _file_sha256(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+def _chunk_hash(content: str) -> str:
+    # Le modèle d'embedding fait partie de la clé: en changer invalide tous les vecteurs
+    return hashlib.sha1(f"{embedder.key}\x00{content}".encode("utf-8")).hexdigest()
+
+def _entries_from_parsed(structured_data: List[Dict[str, Any]], source: Path) -> List[Dict[str, Any]]:
+    entries: List[Dict[str, Any]] = []
+    for item in structured_data:
+        content = item["content"]
+        if item["type"] == "table_cell":
+            ctx = item["context"]
+            content = (
+                f"{ctx.get('title','')}\n"
+                f"{ctx.get('service_name','')}\n"
+                f"{content}"
+            )
+        else:
+            title = item.get("title")
+            subtitle = item.get("subtitle") if "subtitle" in item else None
+            enriched_content = content
+            if subtitle:
+                enriched_content = f"{subtitle} | {enriched_content}"
+            if title:
+                enriched_content = f"{title} | {enriched_content}"
+            content = enriched_content
+
+        entries.append({
+            "source": str(source),
+            "type": item["type"],
+            "title": item.get("title"),
+            "subtitle": item.get("subtitle"),
+            "content": content,
+            "context": item.get("context"),
+        })
+    return entries
+
+
+# --- Incremental builds ------------------------------------------------------
+# Le manifest de chaque génération (index_store) garde le hash de chaque fichier
+# source et de chaque chunk; un rebuild ne ré-embed que les chunks nouveaux ou
+# modifiés et recopie les vecteurs des autres.
+INDEX_VECTOR_DTYPE = os.getenv("INDEX_VECTOR_DTYPE", "float32")  # float32 | float16 | int8
+# ANN (IVF) choisi au build; en dessous de INDEX_ANN_MIN_ROWS la recherche exacte est plus rapide
+INDEX_ANN = os.getenv("INDEX_ANN", "none")  # none | ivf
+INDEX_ANN_MIN_ROWS = int(os.getenv("INDEX_ANN_MIN_ROWS", "20000"))
+INDEX_IVF_NLIST = int(os.getenv("INDEX_IVF_NLIST", "0"))  # 0 = 4 * sqrt(rows)
+INDEX_IVF_NPROBE = int(os.getenv("INDEX_IVF_NPROBE", "8"))
+
+
+def _index_dir(name: str) -> Path:
+    return INDEX_DIR / f"index_{name}"
+
+
+class EmbeddingMismatchError(RuntimeError):
+    """The index was embedded by another provider / model / dimension than the configured one."""
+
+
+def embedding_mismatch(manifest: Dict[str, Any], dim: Optional[int] = None) -> Optional[str]:
+    """Why vectors described by `manifest` (or of width `dim`) cannot be compared with `embedder`'s, else None."""
+    # Manifests antérieurs au champ "embedding": toujours Azure, identifiés par le déploiement
+    info = manifest.get("embedding") or {"provider": "azure", "model": manifest.get("emb_deployment"), "dim": dim}
+    if manifest and (info.get("provider"), info.get("model")) != (embedder.name, embedder.key):
+        return f"built with {info.get('provider')}/{info.get('model')}, configured for {embedder.name}/{embedder.key}"
+    dim = info.get("dim") or dim
+    if dim and embedder.dim and int(dim) != embedder.dim:
+        return f"{dim}-d vectors, configured embedder produces {embedder.dim}-d"
+    return None
+
+
+def _check_embedding(language: str, manifest: Dict[str, Any], dim: int) -> None:
+    reason = embedding_mismatch(manifest, dim)
+    if reason is not None:
+        raise EmbeddingMismatchError(f"Index for language '{language}' does not match EMB_PROVIDER ({reason}); rebuild it.")
+
+
+def _read_manifest(name: str) -> Dict[str, Any]:
+    """Manifest of the live generation, or {} if its vectors cannot be reused."""
+    manifest = read_manifest(_index_dir(name))
+    if (
+        manifest.get("format_version") != FORMAT_VERSION
+        or embedding_mismatch(manifest) is not None
+        or not can_reuse(manifest.get("dtype", ""), INDEX_VECTOR_DTYPE)
+    ):
+        return {}
+    return manifest
+
+
+def _current_generation(name: str) -> int:
+    # Monotone même après un rebuild complet ou un changement de déploiement
+    try:
+        return int(read_manifest(_index_dir(name)).get("generation", 0))
+    except ValueError:
+        return 0
+
+
+def _load_previous(name: str, manifest: Dict[str, Any]) -> Optional[StoredIndex]:
+    gen_dir = current_dir(_index_dir(name))
+    if not manifest or gen_dir is None:
+        return None
+    try:
+        return read_index(gen_dir)
+    except (FileNotFoundError, RuntimeError, KeyError):
+        return None
+
+
+def _reusable_entries(manifest: Dict[str, Any], prev: Optional[StoredIndex], src: str, sha: str) -> Optional[List[Dict[str, Any]]]:
+    known = manifest.get("files", {}).get(src)
+    if prev is None or not known or known.get("sha256") != sha:
+        return None
+    rows = np.flatnonzero(prev.meta.column("source") == prev.meta.code(src))
+    if len(rows) != len(known.get("chunks", [])):
+        return None
+    return [prev.meta[int(i)] for i in rows]
+
+
+Progress = Optional[Callable[[str, Dict[str, Any]], None]]
+
+
+def _emit(progress: Progress, event: str, **fields: Any) -> None:
+    """Log a build_stage / build_progress event and forward it to the job's progress callback."""
+    log(event, **fields)
+    if progress is not None:
+        progress(event, fields)
+
+
+def _write_index(
+    name: str,
+    entries_by_file: Dict[str, List[Dict[str, Any]]],
+    file_hashes: Dict[str, str],
+    manifest: Dict[str, Any],
+    prev: Optional[StoredIndex],
+    progress: Progress = None,
+    publish: bool = True,
+) -> Tuple[Dict[str, Any], Path]:
+    """Write a new generation of the `name` index; published right away unless `publish` is False."""
+    entries = [e for src in sorted(entries_by_file) for e in entries_by_file[src]]
+    if not entries:
+        raise RuntimeError(f"No HTML files found under {PHASE2_DATA_DIR.resolve()}")
+    entries.sort(key=_facet_sort_key)
+    hashes = [_chunk_hash(e["content"]) for e in entries]
+
+    prev_rows: Dict[str, int] = {}
+    if prev is not None:
+        for i in range(len(prev.meta)):
+            prev_rows.setdefault(_chunk_hash(prev.meta.content_at(i)), i)
+    reuse = [(i, prev_rows[h]) for i, h in enumerate(hashes) if h in prev_rows]
+    todo = [i for i, h in enumerate(hashes) if h not in prev_rows]
+
+    # Stockés normalisés (L2): la recherche se réduit à un produit scalaire
+    new_vecs = embed_texts([entries[i]["content"] for i in todo], normalize=True) if todo else None
+    dim = new_vecs.shape[1] if new_vecs is not None else prev.vecs.shape[1]
+    vecs = np.empty((len(entries), dim), dtype="float32")
+    if reuse:
+        dst, src = (np.asarray(x) for x in zip(*reuse))
+        scales = None if prev.scales is None else prev.scales[src]
+        vecs[dst] = l2_normalize(dequantize(prev.vecs[src], scales))
+    if todo:
+        vecs[todo] = new_vecs
+
+    chunks: Dict[str, List[str]] = defaultdict(list)
+    for e, h in zip(entries, hashes):
+        chunks[e["source"]].append(h)
+    ann: Dict[str, Any] = {"kind": "none"}
+    extra_arrays: Dict[str, np.ndarray] = build_bm25([e["content"] for e in entries])
+    facet_labels, facet_arrays = FacetIndex.build_arrays(entries)
+    extra_arrays.update(facet_arrays)
+    if INDEX_ANN == "ivf" and len(entries) >= INDEX_ANN_MIN_ROWS:
+        nlist = INDEX_IVF_NLIST or default_nlist(len(entries))
+        _emit(progress, "build_stage", index=name, stage="ann", kind="ivf", nlist=nlist)
+        extra_arrays.update(train_ivf(vecs, nlist))
+        ann = {"kind": "ivf", "nlist": int(extra_arrays["ivf_centroids"].shape[0])}
+
+    generation = _current_generation(name) + 1
+    gen_dir = write_generation(_index_dir(name), vecs, entries, {
+        "generation": generation,
+        "emb_deployment": embedder.key,
+        "embedding": {"provider": embedder.name, "model": embedder.key, "dim": int(dim)},
+        "built_at": time.time(),
+        "ann": ann,
+        "lexical": {"vocab": "sorted"},
+        "facets": facet_labels,
+        "files": {src: {"sha256": file_hashes[src], "chunks": chunks.get(src, [])} for src in sorted(file_hashes)},
+    }, dtype=INDEX_VECTOR_DTYPE, extra_arrays=extra_arrays, publish=publish)
+    return {"count": len(entries), "embedded": len(todo), "reused": len(reuse), "generation": generation}, gen_dir
+
+
+# --- Parallel pipeline -------------------------------------------------------
+
+# Traduction (réseau) sur un pool de threads, parsing BeautifulSoup (CPU) sur un
+# pool de processus: chaque fichier est parsé dès que sa traduction est prête.
+BUILD_TRANSLATE_WORKERS = int(os.getenv("BUILD_TRANSLATE_WORKERS", "4"))
+BUILD_PARSE_WORKERS = int(os.getenv("BUILD_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+
+def _parse_entries(parse_path: str, source: str) -> List[Dict[str, Any]]:
+    # Fonction de module (picklable) exécutée dans les processus de parsing
+    return _entries_from_parsed(parse_html(Path(parse_path)), Path(source))
+
+
+@contextmanager
+def _parse_pool(n_jobs: int):
+    if BUILD_PARSE_WORKERS <= 1 or n_jobs <= 1:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=min(BUILD_PARSE_WORKERS, n_jobs)) as pool:
+        yield pool
+
+
+def _parse_all(jobs: List[Tuple[Path, Path]], index: str, progress: Progress = None) -> Dict[str, List[Dict[str, Any]]]:
+    """Parse (parse_path, source) pairs on the process pool; keyed by source."""
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    with _parse_pool(len(jobs)) as pool:
+        if pool is None:
+            for path, src in jobs:
+                out[str(src)] = _parse_entries(str(path), str(src))
+                _emit(progress, "build_progress", index=index, stage="parsed", file=src.name, done=len(out), total=len(jobs))
+            return out
+        futures = {pool.submit(_parse_entries, str(path), str(src)): src for path, src in jobs}
+        for fut in as_completed(futures):
+            src = futures[fut]
+            out[str(src)] = fut.result()
+            _emit(progress, "build_progress", index=index, stage="parsed", file=src.name, done=len(out), total=len(jobs))
+    return out
+
+
+def build_index_with_translated_files(full: bool = False, progress: Progress = None, publish: bool = True) -> Dict[str, Any]:
     """
     Build an index by first translating each file, then parsing the translated content.
+    Only files whose source changed are re-translated / re-parsed, and only new
+    or changed chunks are re-embedded (unless `full`). `progress(event, fields)`
+    receives every build_stage / build_progress event. With `publish=False` the
+    new generation is left unpublished; its directory is returned under "path".
     """
-    entries: List[Dict[str, Any]] = []
-    files = list(PHASE2_DATA_DIR.rglob("*.html"))
+    files = sorted(PHASE2_DATA_DIR.rglob("*.html"))
+    # Les traductions en cache restent valables même en rebuild complet si la source n'a pas changé
+    translations = read_manifest(_index_dir("translated")).get("files", {})
+    manifest = {} if full else _read_manifest("translated")
+    prev = _load_previous("translated", manifest)
 
+    entries_by_file: Dict[str, List[Dict[str, Any]]] = {}
+    file_hashes: Dict[str, str] = {}
+    pending: List[Path] = []
     for f in files:
-        translated_file_path = INDEX_DIR / f"translated_{f.name}"
-        if translated_file_path.exists():
-            translated_content = translated_file_path.read_text(encoding="utf-8")
+        src, sha = str(f), _file_sha256(f)
+        file_hashes[src] = sha
+        reused = _reusable_entries(manifest, prev, src, sha)
+        if reused is not None:
+            entries_by_file[src] = reused
         else:
-            translated_content = translate_file(f, target_language="en")
-            translated_file_path.write_text(translated_content, encoding="utf-8")
-        
-        # Parse the translated file
-        structured_data = parse_html(translated_file_path)
-        for item in structured_data:
-            content = item["content"]
-            if item["type"] == "table_cell":
-                ctx = item["context"]
-                content = (
-                    f"{ctx.get('title','')}\n"
-                    f"{ctx.get('service_name','')}\n"
-                    f"{content}"
-                )
-            else:
-                title = item.get("title")
-                subtitle = item.get("subtitle") if "subtitle" in item else None
-                enriched_content = content
-                if subtitle:
-                    enriched_content = f"{subtitle} | {enriched_content}"
-                if title:
-                    enriched_content = f"{title} | {enriched_content}"
-                content = enriched_content
-
-            # Add to original entries
-            entries.append({
-                "source": str(f),
-                "type": item["type"],
-                "title": item.get("title"),
-                "subtitle": item.get("subtitle"),
-                "content": content,
-                "context": item.get("context"),
-            })
-    if not entries:
-        raise RuntimeError(f"No HTML files found under {PHASE2_DATA_DIR.resolve()}")
+            pending.append(f)
+
+    def _translated_path(f: Path) -> Path:
+        translated_file_path = INDEX_DIR / f"translated_{f.name}"
+        known = translations.get(str(f))
+        if translated_file_path.exists() and (known is None or known.get("sha256") == file_hashes[str(f)]):
+            return translated_file_path  # traduction à jour (ou index antérieur au manifest)
+        _atomic_write_text(translated_file_path, translate_file(f, target_language="en"))
+        return translated_file_path
+
+    _emit(progress, "build_stage", index="translated", stage="translate", files=len(pending), reused_files=len(entries_by_file))
+    with ThreadPoolExecutor(max_workers=max(1, BUILD_TRANSLATE_WORKERS)) as tpool, _parse_pool(len(pending)) as ppool:
+        translate_futs = {tpool.submit(_translated_path, f): f for f in pending}
+        parse_futs = {}
+        for fut in as_completed(translate_futs):
+            f = translate_futs[fut]
+            path = fut.result()
+            _emit(progress, "build_progress", index="translated", stage="translated", file=f.name,
+                done=len(parse_futs) + 1, total=len(pending))
+            # Parse the translated file as soon as it is ready
+            parse_futs[(ppool or tpool).submit(_parse_entries, str(path), str(f))] = f
+        for done, fut in enumerate(as_completed(parse_futs), start=1):
+            f = parse_futs[fut]
+            entries_by_file[str(f)] = fut.result()
+            _emit(progress, "build_progress", index="translated", stage="parsed", file=f.name, done=done, total=len(pending))
+
+    for src in set(translations) - set(file_hashes):
+        (INDEX_DIR / f"translated_{Path(src).name}").unlink(missing_ok=True)
+
+    _emit(progress, "build_stage", index="translated", stage="embed", rows=sum(len(v) for v in entries_by_file.values()))
+    res, gen_dir = _write_index("translated", entries_by_file, file_hashes, manifest, prev, progress, publish=publish)
+    _emit(progress, "build_stage", index="translated", stage="done", **res)
+    return {**res, "files": len(files), "parsed": len(pending), "path": gen_dir}
 
-    # Generate embeddings for all content
-    vecs = embed_texts([e["content"] for e in entries])
-    np.save(INDEX_DIR / "vectors_translated.npy", vecs)
-    with open(INDEX_DIR / "meta_translated.json", "w", encoding="utf-8") as w:
-        json.dump(entries, w, ensure_ascii=False, indent=2)
+@contextmanager
+def _build_lock():
+    # Un seul build par machine, même avec plusieurs workers uvicorn (chacun a sa file de jobs)
+    INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    with open(INDEX_DIR / ".build.lock", "w") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
 
-    return {"count": len(entries), "files": len(files)}
 
-def build_index() -> Dict[str, Any]:
+def build_index(full: bool = False, progress: Progress = None) -> Dict[str, Any]:
     """
     Build two indices:
       - One with original content only.
       - One with translations to English.
-      - Save separate vectors.npy and meta.json for each.
+      - Save separate vectors_*.npy, meta_*.json and manifest_*.json for each.
+    Rebuilds are incremental (see _write_index) unless `full` is set. The
+    translated index is built concurrently with the original one; both new
+    generations are published only once both builds have succeeded, so the
+    live Hebrew and English indices always come from the same build.
     """
-    entries_original: List[Dict[str, Any]] = []
-    files = list(PHASE2_DATA_DIR.rglob("*.html"))
+    t0 = time.time()
+    with _build_lock(), ThreadPoolExecutor(max_workers=1) as side:
+        translation_fut = side.submit(build_index_with_translated_files, full, progress, False)
 
-    for f in files:
-        structured_data = parse_html(f)
-        for item in structured_data:
-            content = item["content"]
-            if item["type"] == "table_cell":
-                ctx = item["context"]
-                content = (
-                    f"{ctx.get('title','')}\n"
-                    f"{ctx.get('service_name','')}\n"
-                    f"{content}"
-                )
+        files = sorted(PHASE2_DATA_DIR.rglob("*.html"))
+        manifest = {} if full else _read_manifest("original")
+        prev = _load_previous("original", manifest)
+
+        entries_by_file: Dict[str, List[Dict[str, Any]]] = {}
+        file_hashes: Dict[str, str] = {}
+        jobs: List[Tuple[Path, Path]] = []
+        for f in files:
+            src, sha = str(f), _file_sha256(f)
+            file_hashes[src] = sha
+            reused = _reusable_entries(manifest, prev, src, sha)
+            if reused is not None:
+                entries_by_file[src] = reused
             else:
-                title = item.get("title")
-                subtitle = item.get("subtitle") if "subtitle" in item else None
-                enriched_content = content
-                if subtitle:
-                    enriched_content = f"{subtitle} | {enriched_content}"
-                if title:
-                    enriched_content = f"{title} | {enriched_content}"
-                content = enriched_content
-
-            # Add to original entries
-            entries_original.append({
-                "source": str(f),
-                "type": item["type"],
-                "title": item.get("title"),
-                "subtitle": item.get("subtitle"),
-                "content": content,
-                "context": item.get("context"),
-            })
-
-
-    if not entries_original:
-        raise RuntimeError(f"No HTML files found under {PHASE2_DATA_DIR.resolve()}")
+                jobs.append((f, f))
+        entries_by_file.update(_parse_all(jobs, index="original", progress=progress))
 
-    # Generate embeddings for original content
-    vecs_original = embed_texts([e["content"] for e in entries_original])
-    np.save(INDEX_DIR / "vectors_original.npy", vecs_original)
-    with open(INDEX_DIR / "meta_original.json", "w", encoding="utf-8") as w:
-        json.dump(entries_original, w, ensure_ascii=False, indent=2)
+        _emit(progress, "build_stage", index="original", stage="embed", rows=sum(len(v) for v in entries_by_file.values()))
+        original, original_dir = _write_index("original", entries_by_file, file_hashes, manifest, prev, progress, publish=False)
+        _emit(progress, "build_stage", index="original", stage="done", **original)
+        translation = translation_fut.result()
 
-    translation = build_index_with_translated_files()
+        # Les deux builds ont réussi: bascule des deux pointeurs CURRENT (sinon aucun n'est publié)
+        publish_generation(original_dir)
+        publish_generation(translation["path"])
+        log("index_published", original=original["generation"], translated=translation["generation"])
 
     return {
-        "original_count": len(entries_original),
+        "original_count": original["count"],
         "translated_count": translation["count"],
         "files": len(files),
+        "embedded": original["embedded"] + translation["embedded"],
+        "reused": original["reused"] + translation["reused"],
+        "generation": {"original": original["generation"], "translated": translation["generation"]},
+        "seconds": round(time.time() - t0, 2),
     }
 
 def load_index() -> Tuple[np.ndarray, List[Dict[str, Any]]]:
@@ -292,80 +795,529 @@ def load_index() -> Tuple[np.ndarray, List[Dict[str, Any]]]:
 
 
 # === Search ==================================================================
-def _canon_hmo(x: str | None) -> str:
+def canon_hmo(x: str | None) -> str:
     m = {"מכבי":"מכבי","maccabi":"מכבי","מאוחדת":"מאוחדת","meuhedet":"מאוחדת","כללית":"כללית","clalit":"כללית"}
     if not x: return ""
     x = x.strip()
     return m.get(x, m.get(x.lower(), x))
 
-def _canon_tier(x: str | None) -> str:
+def canon_tier(x: str | None) -> str:
     m = {"זהב":"זהב","gold":"זהב","כסף":"כסף","silver":"כסף","ארד":"ארד","bronze":"ארד"}
     if not x: return ""
     x = x.strip()
     return m.get(x, m.get(x.lower(), x))
 
 def _strict_indices(meta, hmo: str, tier: str):
-    want_hmo, want_tier = _canon_hmo(hmo), _canon_tier(tier)
+    want_hmo, want_tier = canon_hmo(hmo), canon_tier(tier)
     idxs = []
     for i, m in enumerate(meta):
         if m.get("type") != "table_cell":
             continue
         ctx = m.get("context") or {}
-        hit_hmo = _canon_hmo(ctx.get("hmo_name"))
-        hit_tier = _canon_tier(ctx.get("level"))
+        hit_hmo = canon_hmo(ctx.get("hmo_name"))
+        hit_tier = canon_tier(ctx.get("level"))
         if hit_hmo and hit_tier and hit_hmo == want_hmo and hit_tier == want_tier:
             idxs.append(i)
     return idxs
 
-def load_index_by_language(language: str = "he") -> Tuple[np.ndarray, List[Dict[str, Any]]]:
-    if language == "en":
-        vec_path = INDEX_DIR / "vectors_translated.npy"
-        meta_path = INDEX_DIR / "meta_translated.json"
-    else:
-        vec_path = INDEX_DIR / "vectors_original.npy"
-        meta_path = INDEX_DIR / "meta_original.json"
-    if not vec_path.exists() or not meta_path.exists():
-        raise FileNotFoundError(f"Index for language '{language}' not built yet.")
-    vecs = np.load(vec_path)
-    meta = json.loads(meta_path.read_text(encoding="utf-8"))
-    return vecs, meta
+# === Resident index ==========================================================
+# Les fichiers sont mappés (mmap) une seule fois par génération et partagés par
+# toutes les requêtes; un simple stat() détecte un rebuild et déclenche le reload.
+INDEX_RELOAD_CHECK_SECS = float(os.getenv("INDEX_RELOAD_CHECK_SECS", "1.0"))
+# hybrid: BM25 d'abord, fusion (RRF) avec les vecteurs, embedding sauté si le lexical suffit
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")  # hybrid | vector
+LEXICAL_SKIP_CONFIDENCE = float(os.getenv("LEXICAL_SKIP_CONFIDENCE", "0.9"))
+# Hits lexicaux requis pour sauter les vecteurs sur une vue: 0 = son k complet.
+# Une valeur plus basse rend moins de k lignes pour cette vue (moins de rappel).
+LEXICAL_SKIP_MIN_HITS = int(os.getenv("LEXICAL_SKIP_MIN_HITS", "0"))
 
-def search_basic(query: str, k: int = 6, language: str = "he"):
-    vecs, meta = load_index_by_language(language)
-    qv = embed_texts([query])[0].reshape(1, -1)
-    sims = cosine_similarity(qv, vecs)[0]
-    idxs = np.argsort(-sims)[:k]
+
+def _index_name(language: str) -> str:
+    return "translated" if language == "en" else "original"
+
+
+def _index_paths(language: str) -> Tuple[Path, Path]:
+    # Format historique (v1): vectors_*.npy + meta_*.json à plat dans INDEX_DIR
+    name = _index_name(language)
+    return INDEX_DIR / f"vectors_{name}.npy", INDEX_DIR / f"meta_{name}.json"
+
+
+def _file_stamp(*paths: Path) -> Tuple[Tuple[int, int, int], ...]:
+    out = []
+    for p in paths:
+        st = p.stat()
+        out.append((st.st_ino, st.st_size, st.st_mtime_ns))
+    return tuple(out)
+
+
+def _index_stamp(language: str):
+    pointer = _index_dir(_index_name(language)) / "CURRENT"
+    if pointer.exists():
+        return _file_stamp(pointer)
+    return _file_stamp(*_index_paths(language))
+
+
+Rows = Union[slice, np.ndarray]
+
+
+def _facet_sort_key(entry: Dict[str, Any]) -> Tuple[int, str, str]:
+    # Regroupe les cellules de tableau par (hmo, tier): chaque facette stricte devient un bloc contigu
+    if entry.get("type") != "table_cell":
+        return (1, "", "")
+    ctx = entry.get("context") or {}
+    return (0, canon_hmo(ctx.get("hmo_name")), canon_tier(ctx.get("level")))
+
+
+def _as_rows(idxs) -> Rows:
+    arr = np.asarray(idxs, dtype=np.int64)
+    if len(arr) and arr[-1] - arr[0] + 1 == len(arr):
+        return slice(int(arr[0]), int(arr[-1]) + 1)  # bloc contigu -> vue sans copie
+    arr.flags.writeable = False
+    return arr
+
+
+def _split_by_code(codes: np.ndarray) -> Dict[int, np.ndarray]:
+    """Ascending row arrays per distinct code."""
+    order = np.argsort(codes, kind="stable")
+    uniq, starts = np.unique(codes[order], return_index=True)
+    bounds = list(starts[1:]) + [len(order)]
+    return {int(u): order[a:b] for u, a, b in zip(uniq, starts, bounds)}
+
+
+class FacetIndex:
+    """
+    Row sets per canonical (hmo, tier) and per service_name / source / type.
+    Stored with the generation (facet_rows / facet_offsets, labels in the
+    manifest) so that every worker maps the same pages; indexes without them
+    are grouped once per load.
+    """
+
+    FIELDS = ("service_name", "source", "type")
+
+    def __init__(self, hmo_tier, fields):
+        self.hmo_tier: Dict[Tuple[str, str], Rows] = {k: _as_rows(v) for k, v in hmo_tier.items()}
+        self.fields: Dict[str, Dict[str, Rows]] = {
+            f: {k: _as_rows(v) for k, v in groups.items()} for f, groups in fields.items()
+        }
+
+    @classmethod
+    def from_meta(cls, meta) -> "FacetIndex":
+        if isinstance(meta, ColumnarMeta):
+            return cls(*cls._group_columns(meta))
+        return cls(*cls._group_dicts(meta))
+
+    @classmethod
+    def from_arrays(cls, labels: List[List[str]], arrays: Dict[str, np.ndarray]) -> "FacetIndex":
+        rows, offsets = arrays["facet_rows"], arrays["facet_offsets"]
+        hmo_tier: Dict[Tuple[str, str], np.ndarray] = {}
+        fields: Dict[str, Dict[str, np.ndarray]] = {f: {} for f in cls.FIELDS}
+        for i, (kind, *key) in enumerate(labels):
+            view = rows[offsets[i]:offsets[i + 1]]  # vue sur le mmap, pas de copie
+            if kind == "hmo_tier":
+                hmo_tier[(key[0], key[1])] = view
+            else:
+                fields[kind][key[0]] = view
+        return cls(hmo_tier, fields)
+
+    @staticmethod
+    def is_stored(manifest: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> bool:
+        return "facets" in manifest and "facet_rows" in arrays
+
+    @classmethod
+    def build_arrays(cls, entries: List[Dict[str, Any]]) -> Tuple[List[List[str]], Dict[str, np.ndarray]]:
+        """(labels for the manifest, facet_rows / facet_offsets arrays) for entries in index order."""
+        hmo_tier, fields = cls._group_dicts(entries)
+        groups = [(["hmo_tier", *k], v) for k, v in sorted(hmo_tier.items())]
+        groups += [([f, k], v) for f in cls.FIELDS for k, v in sorted(fields[f].items())]
+        offsets = np.zeros(len(groups) + 1, dtype=np.int64)
+        np.cumsum([len(v) for _, v in groups], out=offsets[1:])
+        rows = np.fromiter((r for _, v in groups for r in v), dtype=np.int64, count=int(offsets[-1]))
+        return [label for label, _ in groups], {"facet_rows": rows, "facet_offsets": offsets}
+
+    @classmethod
+    def _group_dicts(cls, meta):
+        hmo_tier: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+        fields: Dict[str, Dict[str, List[int]]] = {f: defaultdict(list) for f in cls.FIELDS}
+        for i, m in enumerate(meta):
+            ctx = m.get("context")
+            ctx = ctx if isinstance(ctx, dict) else {}
+            if m.get("type") == "table_cell":
+                hit_hmo = canon_hmo(ctx.get("hmo_name"))
+                hit_tier = canon_tier(ctx.get("level"))
+                if hit_hmo and hit_tier:
+                    hmo_tier[(hit_hmo, hit_tier)].append(i)
+            if ctx.get("service_name"):
+                fields["service_name"][ctx["service_name"].strip()].append(i)
+            fields["source"][str(m.get("source") or "")].append(i)
+            fields["type"][str(m.get("type") or "")].append(i)
+        return hmo_tier, fields
+
+    @classmethod
+    def _group_columns(cls, meta: ColumnarMeta):
+        # Groupement vectorisé sur les codes: canonicalisation une fois par chaîne distincte
+        n_strings = len(meta.strings) + 1
+        hmo, level = meta.column("hmo_name"), meta.column("level")
+        cells = (meta.column("type") == meta.code("table_cell")) & (hmo >= 0) & (level >= 0)
+        rows = np.flatnonzero(cells)
+        hmo_tier: Dict[Tuple[str, str], List[np.ndarray]] = defaultdict(list)
+        for pair, grp in _split_by_code(hmo[rows].astype(np.int64) * n_strings + level[rows]).items():
+            key = (canon_hmo(meta.decode(pair // n_strings)), canon_tier(meta.decode(pair % n_strings)))
+            if key[0] and key[1]:
+                hmo_tier[key].append(rows[grp])
+
+        fields: Dict[str, Dict[str, List[np.ndarray]]] = {f: defaultdict(list) for f in cls.FIELDS}
+        for field in cls.FIELDS:
+            for code, grp in _split_by_code(np.asarray(meta.column(field))).items():
+                value = (meta.decode(code) or "").strip() if field == "service_name" else (meta.decode(code) or "")
+                if field == "service_name" and not value:
+                    continue
+                fields[field][value].append(grp)
+
+        merge = lambda parts: np.sort(np.concatenate(parts))
+        return (
+            {k: merge(v) for k, v in hmo_tier.items()},
+            {f: {k: merge(v) for k, v in groups.items()} for f, groups in fields.items()},
+        )
+
+    def strict(self, hmo: str, tier: str) -> Optional[Rows]:
+        return self.hmo_tier.get((canon_hmo(hmo), canon_tier(tier)))
+
+    def rows(self, field: str, value: str) -> Optional[Rows]:
+        return self.fields.get(field, {}).get(value.strip())
+
+
+class LoadedIndex:
+    """One language's vectors (read-only mmap), metadata and facets."""
+
+    def __init__(self, language: str, vecs: np.ndarray, meta, stamp,
+                 scales: Optional[np.ndarray] = None, manifest: Optional[Dict[str, Any]] = None,
+                 extras: Optional[Dict[str, np.ndarray]] = None):
+        self.language = language
+        self.vecs = vecs
+        self.scales = scales
+        self.meta = meta
+        self.manifest = manifest or {}
+        self.generation = int(self.manifest.get("generation", 0))
+        self.stamp = stamp
+        if extras and FacetIndex.is_stored(self.manifest, extras):
+            self.facets = FacetIndex.from_arrays(self.manifest["facets"], extras)
+        else:
+            self.facets = FacetIndex.from_meta(meta)
+        self.ann: Optional[IVFIndex] = None
+        if self.manifest.get("ann", {}).get("kind") == "ivf" and extras:
+            self.ann = IVFIndex.from_arrays(extras, nprobe=INDEX_IVF_NPROBE)
+        if extras and BM25Index.is_stored(extras):
+            self.lexical = BM25Index(extras, sorted_vocab=self.manifest.get("lexical", {}).get("vocab") == "sorted")
+        else:
+            # index v1 (meta JSON): listes inversées construites au chargement
+            self.lexical = BM25Index.from_texts([m["content"] for m in meta])
+        self.loaded_at = time.time()
+
+    def search(self, query: np.ndarray, k: int, rows: Optional["Rows"] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k over the whole index or `rows`, through the ANN lists when the index has them."""
+        if self.ann is not None:
+            return self.ann.search(self.vecs, query, k, rows=rows, scales=self.scales)
+        return knn_search(self.vecs, query, k, rows=rows, scales=self.scales)
+
+
+class IndexManager:
+    """
+    Keeps each language's index resident for the lifetime of the process.
+    Usage:
+        vecs, meta = index_manager.get("he").vecs, index_manager.get("he").meta
+    """
+
+    def __init__(self, check_interval: float = INDEX_RELOAD_CHECK_SECS):
+        self.check_interval = check_interval
+        self._loaded: Dict[str, LoadedIndex] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._rejected: Dict[str, Tuple[Any, EmbeddingMismatchError]] = {}  # langue -> (stamp, erreur)
+        self._lock = threading.Lock()
+
+    def _load_checked(self, language: str) -> LoadedIndex:
+        """_load, except that a generation already rejected for its embedding is not read again."""
+        stamp = _index_stamp(language)
+        rejected = self._rejected.get(language)
+        if rejected is not None and rejected[0] == stamp:
+            raise rejected[1]
+        try:
+            return self._load(language)
+        except EmbeddingMismatchError as e:
+            self._rejected[language] = (stamp, e)
+            log("index_rejected", language=language, error=str(e))  # une fois par génération
+            raise
+
+    def _load(self, language: str) -> LoadedIndex:
+        with span("index_load"):
+            index_dir = _index_dir(_index_name(language))
+            # Stamp pris avant de résoudre CURRENT: si un build le remplace entre les
+            # deux, l'ancienne génération porte l'ancien stamp et sera rechargée
+            stamp = _index_stamp(language) if (index_dir / "CURRENT").exists() else None
+            gen_dir = current_dir(index_dir)
+            if gen_dir is not None and stamp is not None:
+                stored = read_index(gen_dir)
+                _check_embedding(language, stored.manifest, stored.vecs.shape[1])
+                return LoadedIndex(language, stored.vecs, stored.meta, stamp, stored.scales, stored.manifest, stored.extras)
+            return self._load_legacy(language)
+
+    def _load_legacy(self, language: str) -> LoadedIndex:
+        vec_path, meta_path = _index_paths(language)
+        if not vec_path.exists() or not meta_path.exists():
+            raise FileNotFoundError(f"Index for language '{language}' not built yet.")
+        stamp = _file_stamp(vec_path, meta_path)
+        vecs = np.load(vec_path, mmap_mode="r")
+        _check_embedding(language, {}, vecs.shape[1])
+        if not is_normalized(vecs):
+            # index construit avant la normalisation au build: copie normalisée en mémoire
+            vecs = l2_normalize(vecs)
+            vecs.flags.writeable = False
+        meta = tuple(json.loads(meta_path.read_text(encoding="utf-8")))
+        if len(meta) != vecs.shape[0]:
+            raise RuntimeError(
+                f"Index for language '{language}' is inconsistent: {vecs.shape[0]} vectors, {len(meta)} meta rows."
+            )
+        return LoadedIndex(language, vecs, meta, stamp)
+
+    def _is_stale(self, current: LoadedIndex) -> bool:
+        try:
+            return _index_stamp(current.language) != current.stamp
+        except FileNotFoundError:
+            return False  # build en cours / fichiers retirés: on garde l'ancienne version
+
+    def get(self, language: str = "he") -> LoadedIndex:
+        current = self._loaded.get(language)
+        now = time.monotonic()
+        if current is not None and now - self._checked_at.get(language, 0.0) < self.check_interval:
+            return current
+        with self._lock:
+            current = self._loaded.get(language)
+            if current is None:
+                current = self._load_checked(language)
+                self._loaded[language] = current
+            elif self._is_stale(current):
+                try:
+                    current = self._load_checked(language)
+                    self._loaded[language] = current
+                    log("index_reloaded", language=language, generation=current.generation, pid=os.getpid())
+                except (FileNotFoundError, RuntimeError):
+                    # génération incomplète ou fichiers en cours de remplacement: on réessaie au prochain check
+                    pass
+            self._checked_at[language] = now
+            return current
+
+    def preload(self, languages: Tuple[str, ...] = ("he", "en")) -> Dict[str, int]:
+        """Load every built language up-front (called at server startup)."""
+        out: Dict[str, int] = {}
+        for lang in languages:
+            try:
+                out[lang] = len(self.get(lang).meta)
+            except FileNotFoundError:
+                continue
+            except EmbeddingMismatchError:
+                continue  # journalisé par _load_checked; le serveur démarre, /build_index reste possible
+        return out
+
+    def generations(self) -> Dict[str, int]:
+        return {lang: idx.generation for lang, idx in list(self._loaded.items())}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded.clear()
+            self._checked_at.clear()
+            self._rejected.clear()
+
+
+index_manager = IndexManager()
+
+
+def load_index_by_language(language: str = "he"):
+    idx = index_manager.get(language)
+    return idx.vecs, idx.meta
+
+def _hits(meta, idxs: np.ndarray, scores: np.ndarray) -> List[Dict[str, Any]]:
     out = []
-    for i in idxs:
-        item = dict(meta[i])
-        item["score"] = float(sims[i])
+    for i, sc in zip(idxs, scores):
+        item = dict(meta[int(i)])
+        item["chunk_id"] = int(i)  # ligne dans la génération courante
+        item["score"] = float(sc)
         out.append(item)
     return out
 
+def _retrieve_views(
+    idx: "LoadedIndex",
+    query: str,
+    views: Dict[str, Tuple[Optional["Rows"], int]],
+    full_scores: Optional[np.ndarray] = None,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Hybrid top-k of several row subsets ("views": name -> (rows, k)) of one
+    index for one query. BM25 scores and, when a view needs them, cosine
+    scores are computed once over the full matrix; each view only selects its
+    top-k from those arrays. `full_scores` are the query's cosine scores if
+    the caller already computed them (batch search).
+
+    Each hit's "score" orders the results: the reciprocal-rank-fusion score
+    in hybrid mode (rank based, comparable across views, not a similarity),
+    the cosine similarity with RETRIEVAL_MODE=vector. The raw signals are
+    kept in "cosine" and "bm25" whenever they were computed; thresholds on
+    similarity must use "cosine".
+    """
+    hybrid = RETRIEVAL_MODE != "vector"
+    with span("lexical"):
+        scored = idx.lexical.score(query) if hybrid else None
+        lexical = {
+            name: idx.lexical.search(query, k, rows=rows, scored=scored) if hybrid else None
+            for name, (rows, k) in views.items()
+        }
+    # la question nomme le service et le lexical remplit la vue: pas d'appel d'embedding
+    confident = {
+        name: lex is not None and lex[2] >= LEXICAL_SKIP_CONFIDENCE
+        and len(lex[0]) >= min(views[name][1], LEXICAL_SKIP_MIN_HITS or views[name][1])
+        for name, lex in lexical.items()
+    }
+    need_vec = [name for name in views if not confident[name]]
+    vector: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+    if need_vec and full_scores is None:
+        q = embed_query(query)
+        with span("similarity"):
+            if idx.ann is None and (len(need_vec) > 1 or views[need_vec[0]][0] is None):
+                full_scores = cosine_scores(idx.vecs, q, idx.scales)  # une seule passe sur la matrice
+            else:
+                vector = {name: idx.search(q, views[name][1], rows=views[name][0]) for name in need_vec}
+    if need_vec and full_scores is not None:
+        with span("facet_filter"):
+            vector = {name: top_k_in(full_scores, views[name][1], views[name][0]) for name in need_vec}
+
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for name, (rows, k) in views.items():
+        if not hybrid:
+            out[name] = _hits(idx.meta, *vector[name])
+            for item in out[name]:
+                item["cosine"] = item["score"]
+            continue
+        lex_rows, lex_scores, _ = lexical[name]
+        bm25 = dict(zip(lex_rows.tolist(), lex_scores.tolist()))
+        cosine: Dict[int, float] = {}
+        if name in vector:
+            vec_rows, vec_scores = vector[name]
+            cosine = dict(zip(vec_rows.tolist(), vec_scores.tolist()))
+            hits, scores = rrf_fuse([vec_rows, lex_rows], k)
+        else:
+            hits, scores = rrf_fuse([lex_rows], k)
+        items = _hits(idx.meta, hits, scores)
+        for item, i in zip(items, hits.tolist()):
+            if i in cosine:
+                item["cosine"] = cosine[i]
+            if i in bm25:
+                item["bm25"] = bm25[i]
+        out[name] = items
+    return out
+
+def _retrieve(idx: "LoadedIndex", query: str, k: int, rows: Optional["Rows"] = None) -> List[Dict[str, Any]]:
+    return _retrieve_views(idx, query, {"hits": (rows, k)})["hits"]
+
+def search_basic(query: str, k: int = 6, language: str = "he"):
+    return _retrieve(index_manager.get(language), query, k)
+
 def search_filtered_strict(query: str, hmo: str, tier: str, k: int = 3, language: str = "he"):
-    vecs, meta = load_index_by_language(language)
-    idxs = _strict_indices(meta, hmo=hmo, tier=tier)
-    if not idxs:
+    idx = index_manager.get(language)
+    rows = idx.facets.strict(hmo, tier)
+    if rows is None:
         return []  # aucun match strict -> rien
-    sub_vecs = vecs[idxs]
     enriched_query = f"{query}"
-    qv = embed_texts([enriched_query])[0].reshape(1, -1)
-    sims = cosine_similarity(qv, sub_vecs)[0]
-    order = np.argsort(-sims)[:k]
-    out = []
-    for j in order:
-        i = idxs[int(j)]
-        item = dict(meta[i])
-        item["score"] = float(sims[int(j)])
-        out.append(item)
-    return out
+    return _retrieve(idx, enriched_query, k, rows=rows)
 
-def search_dual(query: str, hmo: str, tier: str, k_basic: int = 6, k_filtered: int = 3, language: str = "he"):
-    basic = search_basic(query, k=k_basic, language=language)
-    prof = search_filtered_strict(query, hmo=hmo, tier=tier, k=k_filtered, language=language)
-    return {"basic": basic, "filtered": prof}
+def _dual_views(
+    idx: "LoadedIndex", hmo: str, tier: str, k_basic: int, k_filtered: int,
+    facets: Optional[Dict[str, Tuple[str, str]]] = None,
+) -> Dict[str, Tuple[Optional[Rows], int]]:
+    views: Dict[str, Tuple[Optional[Rows], int]] = {"basic": (None, k_basic)}
+    strict = idx.facets.strict(hmo, tier)
+    if strict is not None:  # aucun match strict -> rien
+        views["filtered"] = (strict, k_filtered)
+    for name, (field, value) in (facets or {}).items():
+        rows = idx.facets.rows(field, value)
+        if rows is not None:
+            views[name] = (rows, k_filtered)
+    return views
 
 
+def _merge_views(idx: "LoadedIndex", res: Dict[str, List[Dict[str, Any]]],
+                 facets: Optional[Dict[str, Tuple[str, str]]] = None) -> Dict[str, Any]:
+    merged: Dict[int, Dict[str, Any]] = {}
+    for name, hits in res.items():
+        for h in hits:
+            prev = merged.get(h["chunk_id"])
+            if prev is None:
+                merged[h["chunk_id"]] = {**h, "matched": [name]}
+            else:
+                prev["matched"].append(name)
+                if h["score"] > prev["score"]:
+                    prev.update({k: v for k, v in h.items() if k != "matched"})
+    return {
+        "basic": res["basic"],
+        "filtered": res.get("filtered", []),
+        "facets": {name: res[name] for name in facets or {} if name in res},
+        "merged": sorted(merged.values(), key=lambda h: -h["score"]),
+        "generation": idx.generation,
+    }
 
 
+def search_dual(
+    query: str,
+    hmo: str,
+    tier: str,
+    k_basic: int = 6,
+    k_filtered: int = 3,
+    language: str = "he",
+    facets: Optional[Dict[str, Tuple[str, str]]] = None,
+):
+    """
+    Global and HMO/tier-restricted top-k from a single scoring pass, plus one
+    view per extra facet (name -> (field, value), e.g. {"service": ("service_name", "...")}).
+    "merged" holds every hit once, by descending score, with the views it
+    came from in "matched" (see _retrieve_views for what "score" means).
+    """
+    idx = index_manager.get(language)
+    views = _dual_views(idx, hmo, tier, k_basic, k_filtered, facets)  # lignes précalculées (FacetIndex)
+    return _merge_views(idx, _retrieve_views(idx, query, views), facets)
+
 
+# Octets max de la matrice (questions x lignes) de scores d'un lot
+BATCH_SCORE_BYTES = int(os.getenv("BATCH_SCORE_BYTES", str(256 * 1024 * 1024)))
+
+
+def search_dual_batch(
+    queries: List[Tuple[str, str, str]],
+    k_basic: int = 6,
+    k_filtered: int = 3,
+    language: str = "he",
+) -> List[Dict[str, Any]]:
+    """
+    search_dual for many (question, hmo, tier) at once: the questions missing
+    from the embedding cache are embedded in one embed_texts call, and the
+    cosine scores of the whole batch come from one (questions x rows) matrix
+    multiply, in query blocks bounded by BATCH_SCORE_BYTES.
+    """
+    idx = index_manager.get(language)
+    questions = [q for q, _, _ in queries]
+    known = {q: embedding_cache.peek(EmbeddingCache.key(q)) for q in set(questions)}
+    missing = sorted(q for q, vec in known.items() if vec is None)
+    if missing:
+        with span("embed", embedder.key):
+            fresh = embed_texts(missing)
+        for q, vec in zip(missing, fresh):
+            embedding_cache.put(EmbeddingCache.key(q), vec)
+            known[q] = vec
+    qvecs = np.stack([known[q] for q in questions]) if questions else None
+
+    out: List[Dict[str, Any]] = []
+    block = max(1, BATCH_SCORE_BYTES // max(1, 4 * idx.vecs.shape[0]))
+    for a in range(0, len(queries), block):
+        with span("similarity"):
+            full = cosine_scores(idx.vecs, qvecs[a:a + block], idx.scales) if idx.ann is None else None
+        for j, (question, hmo, tier) in enumerate(queries[a:a + block]):
+            views = _dual_views(idx, hmo, tier, k_basic, k_filtered)
+            res = _retrieve_views(idx, question, views, None if full is None else full[j])
+            out.append(_merge_views(idx, res))
+    return out
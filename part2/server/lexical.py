@@ -0,0 +1,216 @@
+"""
+BM25 inverted index over the KB chunks (Hebrew + English).
+
+Stored next to the vectors as extra arrays of the index generation:
+
+    bm25_vocab_blob / bm25_vocab_offsets   utf-8 terms, concatenated in sorted order (term id = position)
+    bm25_offsets    int64 (terms + 1)      posting-list boundaries
+    bm25_rows       int32                  row ids, ascending inside each posting list
+    bm25_tf         float32                term frequency of each posting
+    bm25_doc_len    float32 (rows,)        tokens per row
+    bm25_idf        float32 (terms,)       inverse document frequency
+
+With a sorted vocabulary, terms are looked up by bisection directly in the
+mmap'd blob: no per-process dictionary of the vocabulary.
+"""
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from vector_search import top_k
+
+# Préfixes d'une lettre collés au mot en hébreu (ו ה ב כ ל מ ש)
+HEBREW_PREFIXES = "והבכלמש"
+_NIQQUD = re.compile("[\u0591-\u05C7]")
+_TOKEN = re.compile(r"\w+")
+_HEBREW = re.compile("[\u05D0-\u05EA]")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it me my of on or the to what which "
+    "with much many there this that your you get have has"
+    .split()
+    + "של את על עם זה זו מה כמה האם אני לי יש הוא היא או גם כל אם לא כן עבור מי איך האם".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Casefolded word tokens without niqqud or stopwords. Hebrew words also emit
+    their forms with up to two prefix letters removed (בהפסקת -> הפסקת),
+    English words a naive singular (cleanings -> cleaning).
+    """
+    text = _NIQQUD.sub("", unicodedata.normalize("NFKC", text)).casefold()
+    text = text.replace("\u05F4", "").replace("\u05F3", "").replace('"', "")
+    out: List[str] = []
+    for tok in _TOKEN.findall(text):
+        if tok in STOPWORDS or (len(tok) < 2 and not tok.isdigit()):
+            continue
+        out.append(tok)
+        if _HEBREW.match(tok):
+            stem = tok
+            for _ in range(2):
+                if len(stem) > 3 and stem[0] in HEBREW_PREFIXES:
+                    stem = stem[1:]
+                    out.append(stem)
+        elif len(tok) > 3 and tok.endswith("s") and not tok.endswith("ss"):
+            out.append(tok[:-1])
+    return out
+
+
+def build_bm25(texts: List[str]) -> Dict[str, np.ndarray]:
+    vocab: Dict[str, int] = {}
+    postings: List[List[Tuple[int, int]]] = []
+    doc_len = np.zeros(len(texts), dtype="float32")
+    for row, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        doc_len[row] = sum(counts.values())
+        for term, tf in counts.items():
+            tid = vocab.setdefault(term, len(vocab))
+            if tid == len(postings):
+                postings.append([])
+            postings[tid].append((row, tf))
+
+    # Ids réattribués dans l'ordre des octets utf-8 (= ordre des code points)
+    terms = sorted(t.encode("utf-8") for t in vocab)
+    postings = [postings[vocab[t.decode("utf-8")]] for t in terms]
+    offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in postings], out=offsets[1:])
+    rows = np.fromiter((r for p in postings for r, _ in p), dtype=np.int32, count=int(offsets[-1]))
+    tf = np.fromiter((t for p in postings for _, t in p), dtype=np.float32, count=int(offsets[-1]))
+    vocab_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in terms], out=vocab_offsets[1:])
+    return {
+        "bm25_vocab_blob": np.frombuffer(b"".join(terms), dtype=np.uint8),
+        "bm25_vocab_offsets": vocab_offsets,
+        "bm25_offsets": offsets,
+        "bm25_rows": rows,
+        "bm25_tf": tf,
+        "bm25_doc_len": doc_len,
+        "bm25_idf": _idf(offsets, len(texts)),
+    }
+
+
+def _idf(offsets: np.ndarray, n_rows: int) -> np.ndarray:
+    df = np.diff(offsets).astype("float32")
+    return np.log(1.0 + (n_rows - df + 0.5) / (df + 0.5)).astype("float32")
+
+
+class BM25Index:
+    """Okapi BM25 scoring over the CSR posting lists built by build_bm25()."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], k1: float = 1.2, b: float = 0.75, sorted_vocab: bool = False):
+        self.blob = arrays["bm25_vocab_blob"]
+        self.voffs = arrays["bm25_vocab_offsets"]
+        self.vocab: Optional[Dict[str, int]] = None
+        if not sorted_vocab:
+            # générations antérieures au vocabulaire trié: dictionnaire en mémoire
+            blob = bytes(np.asarray(self.blob))
+            self.vocab = {blob[self.voffs[i]:self.voffs[i + 1]].decode("utf-8"): i for i in range(len(self.voffs) - 1)}
+        self.offsets = arrays["bm25_offsets"]
+        self.rows = arrays["bm25_rows"]
+        self.tf = arrays["bm25_tf"]
+        self.doc_len = arrays["bm25_doc_len"]
+        self.k1, self.b = k1, b
+        n = len(self.doc_len)
+        self.avgdl = float(np.mean(self.doc_len)) if n else 0.0
+        self.idf = arrays["bm25_idf"] if "bm25_idf" in arrays else _idf(self.offsets, n)
+
+    @classmethod
+    def from_texts(cls, texts: List[str]) -> "BM25Index":
+        return cls(build_bm25(texts), sorted_vocab=True)
+
+    def term_id(self, term: str) -> Optional[int]:
+        if self.vocab is not None:
+            return self.vocab.get(term)
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self.voffs) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bytes(self.blob[self.voffs[mid]:self.voffs[mid + 1]]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.voffs) - 1 and bytes(self.blob[self.voffs[lo]:self.voffs[lo + 1]]) == key:
+            return lo
+        return None
+
+    @staticmethod
+    def is_stored(arrays: Dict[str, np.ndarray]) -> bool:
+        return "bm25_offsets" in arrays
+
+    def _postings(self, tid: int) -> Tuple[np.ndarray, np.ndarray]:
+        a, b = self.offsets[tid], self.offsets[tid + 1]
+        return self.rows[a:b], self.tf[a:b]
+
+    def _contains(self, tid: int, row: int) -> bool:
+        prow, _ = self._postings(tid)
+        i = np.searchsorted(prow, row)
+        return bool(i < len(prow) and prow[i] == row)
+
+    def score(self, query: str) -> Optional[Tuple[np.ndarray, List[int], int]]:
+        """
+        BM25 score of every row for `query` as (scores, query term ids, number of
+        distinct query terms), or None if no query term is in the vocabulary.
+        Computed once, it can serve several search() calls over different rows.
+        """
+        terms = set(tokenize(query))
+        tids = sorted(tid for tid in map(self.term_id, terms) if tid is not None)
+        if not tids or self.avgdl == 0:
+            return None
+        scores = np.zeros(len(self.doc_len), dtype="float32")
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / self.avgdl)
+        for tid in tids:
+            prow, ptf = self._postings(tid)
+            scores[prow] += self.idf[tid] * ptf * (self.k1 + 1) / (ptf + norm[prow])
+        return scores, tids, len(terms)
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        rows: Optional[Union[slice, np.ndarray]] = None,
+        scored: Optional[Tuple[np.ndarray, List[int], int]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, float]:
+        """
+        Top-k rows by BM25 (restricted to `rows` if given) plus a confidence in
+        [0, 1]: the idf-weighted share of the query terms found in the best row.
+        `scored` is a precomputed score(query) to reuse.
+        """
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype="float32"), 0.0)
+        if scored is None:
+            scored = self.score(query)
+        if scored is None:
+            return empty
+        scores, tids, n_terms = scored
+
+        if rows is None:
+            cand = np.flatnonzero(scores)
+        elif isinstance(rows, slice):
+            cand = (rows.start or 0) + np.flatnonzero(scores[rows])
+        else:
+            rows = np.asarray(rows)
+            cand = rows[scores[rows] > 0]
+        if not len(cand):
+            return empty
+        order, vals = top_k(scores[cand], k)
+        hits = cand[order]
+
+        # Part (pondérée par idf) des termes de la requête présents dans la meilleure ligne;
+        # les termes hors vocabulaire comptent comme manquants avec l'idf maximal
+        weights = self.idf[tids]
+        found = np.array([self._contains(t, int(hits[0])) for t in tids])
+        total = float(weights.sum()) + (n_terms - len(tids)) * float(self.idf.max(initial=0.0))
+        confidence = float(weights[found].sum()) / total if total else 0.0
+        return hits.astype(np.int64), vals, confidence
+
+
+def rrf_fuse(rankings: List[np.ndarray], k: int, c: float = 60.0) -> Tuple[np.ndarray, np.ndarray]:
+    """Reciprocal-rank fusion of several ranked row arrays; returns (rows, fused scores)."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            fused[int(row)] = fused.get(int(row), 0.0) + 1.0 / (c + rank + 1)
+    best = sorted(fused.items(), key=lambda kv: -kv[1])[:k]
+    return np.array([r for r, _ in best], dtype=np.int64), np.array([s for _, s in best], dtype="float32")
@@ -1,9 +1,37 @@
+import atexit
 import json
 import logging
+import os
+import queue
+import random
 import sys
+import threading
 import time
 import uuid
-from typing import Any
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, TextIO
+
+# Identifiant de corrélation de la requête HTTP en cours (posé par le middleware de main.py)
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+LOG_BACKEND = os.getenv("LOG_BACKEND", "queue")  # queue | sync
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))
+# Taux d'échantillonnage par type d'événement, ex. "chat_context=0.1,http_request=0.5" (défaut 1)
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates: Dict[str, float] = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        event, _, rate = part.partition("=")
+        try:
+            rates[event.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            raise ValueError(f"Invalid LOG_SAMPLE_RATES entry '{part}' (expected event=rate).")
+    return rates
 
 
 class JsonLogger:
@@ -12,28 +40,141 @@ class JsonLogger:
     Usage:
         from .logger import log
         log("index_built", count=123, files=3)
+
+    With the "queue" backend, `log` only builds the event dict and puts it on
+    a bounded queue; a background thread serializes the events and hands each
+    batch to the "app" logging.Logger as one record (one JSON line per event,
+    one write and flush per batch), so its level and handlers (set by
+    logging.config / uvicorn --log-config) still decide what is written where.
+    Events that find the queue full are dropped and counted.
     """
-    def __init__(self, name: str = "app", level: int = logging.INFO):
+    def __init__(self, name: str = "app", level: int = logging.INFO, backend: str = LOG_BACKEND,
+                 queue_size: int = LOG_QUEUE_SIZE, batch_size: int = LOG_BATCH_SIZE,
+                 sample_rates: Optional[Dict[str, float]] = None, stream: Optional[TextIO] = None):
+        if backend not in ("queue", "sync"):
+            raise ValueError(f"Unknown LOG_BACKEND '{backend}' (expected queue | sync).")
+        self.backend = backend
+        self.batch_size = max(1, batch_size)
+        self.sample_rates = parse_sample_rates(LOG_SAMPLE_RATES) if sample_rates is None else sample_rates
         self.logger = logging.getLogger(name)
         self.logger.setLevel(level)
 
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setLevel(level)
-        handler.setFormatter(logging.Formatter('%(message)s'))
-
         # Avoid duplicate handlers if module reloaded
-        if not any(isinstance(h, logging.StreamHandler) for h in self.logger.handlers):
-            self.logger.addHandler(handler)
+        existing = [h for h in self.logger.handlers if isinstance(h, logging.StreamHandler)]
+        if existing:
+            self._handler = existing[0]
+        else:
+            self._handler = logging.StreamHandler(sys.stdout)
+            self._handler.setLevel(level)
+            self._handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(self._handler)
+        if stream is not None:
+            self.stream = stream
+
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._writer: Optional[threading.Thread] = None
+        self._writer_lock = threading.Lock()
+        # Incrémentés par les threads des requêtes et par le thread d'écriture
+        self._counts_lock = threading.Lock()
+        self.dropped = 0
+        self.sampled_out = 0
+        self.written = 0
+
+    @property
+    def stream(self) -> TextIO:
+        return self._handler.stream
+
+    @stream.setter
+    def stream(self, stream: Optional[TextIO]) -> None:
+        self._handler.setStream(stream or sys.stdout)
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._counts_lock:
+            setattr(self, name, getattr(self, name) + n)
 
     def log(self, event: str, **kwargs: Any) -> None:
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        rate = self.sample_rates.get(event, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            self._count("sampled_out")
+            return
         entry = {
             "event": event,
             "ts": time.time(),
-            "request_id": str(uuid.uuid4()),
+            "request_id": request_id_var.get(),  # lu ici : le thread d'écriture n'a pas le contexte
             **kwargs,
         }
-        self.logger.info(json.dumps(entry, ensure_ascii=False))
+        if self.backend == "sync":
+            self.logger.info(self._dumps(entry))
+            self._count("written")
+            return
+        if self._writer is None or not self._writer.is_alive():
+            self._start_writer()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._count("dropped")
+
+    @staticmethod
+    def _dumps(entry: Dict[str, Any]) -> str:
+        if entry["request_id"] is None:
+            entry["request_id"] = str(uuid.uuid4())
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+    def _start_writer(self) -> None:
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._drain, name="log-writer", daemon=True)
+                self._writer.start()
+
+    def _drain(self) -> None:
+        while True:
+            batch: List[Dict[str, Any]] = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines: List[str] = []
+            for e in batch:
+                try:
+                    lines.append(self._dumps(e))
+                except Exception:
+                    pass  # un événement non sérialisable n'emporte pas le reste du lot
+            try:
+                if lines:
+                    record = self.logger.makeRecord(self.logger.name, logging.INFO, __file__, 0, "\n".join(lines), None, None)
+                    self.logger.handle(record)
+            except Exception:
+                lines = []
+            finally:
+                self._count("written", len(lines))
+                self._count("dropped", len(batch) - len(lines))
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout: float = 2.0) -> None:
+        """Wait (at most `timeout` seconds) until queued events are written."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            if self._writer is None or not self._writer.is_alive():
+                break
+            time.sleep(0.005)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._counts_lock:
+            return {
+                "backend": self.backend,
+                "queued": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "sampled_out": self.sampled_out,
+            }
+
 
+json_logger = JsonLogger()
+atexit.register(json_logger.flush)
 
 # Convenience function
-log = JsonLogger().log
+log = json_logger.log
@@ -1,20 +1,46 @@
 import os
 import json
+import time
+import uuid
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
+import httpx
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
 
 from models import (
     CollectRequest,
     CollectResponse,
     ChatRequest,
     ChatResponse,
+    ChatBatchRequest,
 )
 from prompts import COLLECT_PROMPT, QA_PROMPT
-from kb_index import build_index, search_dual
-from logger import log
+from kb_index import (
+    INDEX_DIR,
+    INDEX_RELOAD_CHECK_SECS,
+    EmbeddingMismatchError,
+    build_index,
+    cached_query_embedding,
+    embedding_cache,
+    index_manager,
+    search_dual,
+    search_dual_batch,
+)
+from context_packer import pack_context
+from intake import INTAKE_RULES, fast_reply
+from build_jobs import BuildJobs
+from answer_cache import AnswerCache, SemanticAnswerCache, answer_cache, semantic_cache
+from logger import json_logger, log, request_id_var
+from metrics import registry, span, start_request_spans
+from streaming import AnswerStream, sse
 
 # === Config & client =========================================================
 load_dotenv()
@@ -24,34 +50,185 @@ AOAI_KEY = os.getenv("AZURE_OPENAI_API_KEY")
 AOAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview")
 CHAT_DEPLOYMENT = os.getenv("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o")
 
-client = AzureOpenAI(
+# Un seul pool HTTP partagé par tous les appels LLM (keep-alive vers Azure)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "20"))
+LLM_TIMEOUT_SECS = float(os.getenv("LLM_TIMEOUT_SECS", "120"))
+# Appels amont simultanés par endpoint; au-delà les requêtes attendent leur tour
+CHAT_MAX_INFLIGHT = int(os.getenv("CHAT_MAX_INFLIGHT", "32"))
+COLLECT_MAX_INFLIGHT = int(os.getenv("COLLECT_MAX_INFLIGHT", "32"))
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "4"))
+# /chat/batch: completions simultanées par lot et taille max d'un lot
+BATCH_MAX_INFLIGHT = int(os.getenv("BATCH_MAX_INFLIGHT", "8"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE),
+    timeout=httpx.Timeout(LLM_TIMEOUT_SECS, connect=10.0),
+)
+client = AsyncAzureOpenAI(
     azure_endpoint=AOAI_ENDPOINT,
     api_key=AOAI_KEY,
     api_version=AOAI_API_VERSION,
+    http_client=http_client,
 )
 
+# Recherche (embedding + numpy) hors de la boucle asyncio; les builds ont leur propre thread (build_jobs)
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+chat_slots = asyncio.Semaphore(CHAT_MAX_INFLIGHT)
+collect_slots = asyncio.Semaphore(COLLECT_MAX_INFLIGHT)
+
+
+async def run_in(executor: ThreadPoolExecutor, fn, *args, **kwargs):
+    # copy_context: le thread garde le request_id et les spans de la requête
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(ctx.run, fn, *args, **kwargs))
+
+
+async def _watch_index():
+    # Chaque worker suit le pointeur CURRENT (un stat) et recharge hors requête
+    # dès qu'un build, lancé par lui ou par un autre worker, publie une génération
+    while True:
+        await asyncio.sleep(INDEX_RELOAD_CHECK_SECS)
+        try:
+            await run_in(search_executor, index_manager.preload)
+        except Exception as e:
+            log("index_watch_error", error=str(e))
+
+
 # === App ====================================================================
-app = FastAPI(title="Stateless HMO Chatbot (Part 2)")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Charge les index une fois (mmap) avant de servir la première requête
+    loaded = await run_in(search_executor, index_manager.preload)
+    log("index_preloaded", **{f"rows_{k}": v for k, v in loaded.items()})
+    watcher = asyncio.create_task(_watch_index())
+    yield
+    watcher.cancel()
+    await http_client.aclose()
+    search_executor.shutdown(wait=False)
+    build_jobs.shutdown()
+    json_logger.flush()
+
+
+app = FastAPI(title="Stateless HMO Chatbot (Part 2)", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
-# === Routes =================================================================
+HTTP_SECONDS = registry.histogram("chatbot_http_request_seconds", "Time to response headers.", ("path",))
+HTTP_REQUESTS = registry.counter("chatbot_http_requests_total", "HTTP requests.", ("path", "status"))
+INTAKE_TURNS = registry.counter("chatbot_intake_turns_total", "/collect turns by path (rules or llm).", ("path",))
 
 
-@app.post("/build_index")
-def api_build_index():
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Correlation id (X-Request-ID, generated if absent) and per-stage timings for every request."""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    request_id_var.set(request_id)
+    spans = start_request_spans()
+    t0 = time.perf_counter()
+    status = 500
     try:
-        res = build_index()
-        log("index_built", **res)
-        return {"status": "ok", **res}
-    except Exception as e:
-        log("index_build_error", error=str(e))
-        raise HTTPException(500, str(e))
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        elapsed = time.perf_counter() - t0
+        HTTP_SECONDS.observe(elapsed, path=path)
+        HTTP_REQUESTS.inc(path=path, status=str(status))
+        if path != "/metrics":
+            log("http_request", method=request.method, path=path, status=status,
+                seconds=round(elapsed, 4), spans=spans)
+
+# === Routes =================================================================
+
+
+def _on_index_built(res):
+    # Nouvelle génération: les réponses en cache portent sur l'ancienne
+    answer_cache.clear()
+    semantic_cache.clear()
+    # Recharge tout de suite (mmap); les recherches en cours gardent l'ancienne génération
+    index_manager.invalidate()
+    index_manager.preload()
+    log("index_built", **res)
+
+
+# État des jobs partagé entre workers uvicorn (chacun a son propre registre en mémoire)
+build_jobs = BuildJobs(build_index, on_success=_on_index_built, state_dir=INDEX_DIR / "jobs")
+
+
+@app.post("/build_index", status_code=202)
+async def api_build_index(full: bool = False, wait: bool = False):
+    """
+    Queue an index build and return its job id right away; poll
+    GET /build_index/{job_id} for progress. `wait=true` holds the request
+    until the job finishes (scripts).
+    """
+    job = build_jobs.submit(full=full)
+    while wait and job.status in ("queued", "running"):
+        await asyncio.sleep(1.0)
+    return {**job.to_dict(), "status_url": f"/build_index/{job.id}"}
+
+
+@app.get("/build_index/{job_id}")
+async def api_build_status(job_id: str):
+    job = build_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Unknown build job '{job_id}'.")
+    return job.to_dict()
+
+
+@app.get("/build_jobs")
+async def api_build_jobs():
+    return [job.to_dict() for job in build_jobs.list()]
+
+
+def _cache_samples():
+    out = {}
+    for name, stats in (("answers", answer_cache.stats()), ("semantic", semantic_cache.stats()),
+                        ("embeddings", embedding_cache.stats())):
+        out[(name, "hit")] = stats["hits"]
+        out[(name, "miss")] = stats["misses"]
+    return out
+
+
+registry.callback("chatbot_cache_lookups_total", "Cache lookups by result.", _cache_samples,
+                  ("cache", "result"), kind="counter")
+registry.callback("chatbot_index_generation", "Live index generation per language.",
+                  lambda: {(lang,): gen for lang, gen in index_manager.generations().items()},
+                  ("language",))
+registry.callback("chatbot_log_events_total", "Log events by outcome (written, dropped on a full queue, sampled out).",
+                  lambda: {(k,): v for k, v in json_logger.stats().items() if k in ("written", "dropped", "sampled_out")},
+                  ("outcome",), kind="counter")
+
+
+@app.get("/metrics")
+async def api_metrics():
+    # answer_cache.stats() compte les lignes SQLite: hors de la boucle
+    text = await run_in(search_executor, registry.render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+def _cache_stats():
+    return {
+        "answers": answer_cache.stats(),
+        "semantic": semantic_cache.stats(),
+        "embeddings": embedding_cache.stats(),
+    }
+
+
+@app.get("/cache/stats")
+async def api_cache_stats():
+    return await run_in(search_executor, _cache_stats)
 
 
 def _normalize_history_for_llm(raw_msgs, limit=12):
@@ -66,11 +243,21 @@ def _normalize_history_for_llm(raw_msgs, limit=12):
 
 
 @app.post("/collect", response_model=CollectResponse)
-def api_collect(req: CollectRequest):
+async def api_collect(req: CollectRequest):
     """
     LLM-led intake (stateless): the client sends history + current user_info.
     The LLM returns a JSON control object: phase, message, missing, userinfo, lang.
+    Single-value answers to the field just asked (id, card, age, HMO, tier,
+    gender, "yes" to the summary) are handled by the rules in intake.py.
     """
+    if INTAKE_RULES:
+        with span("intake_rules"):
+            out = fast_reply(req)
+        if out is not None:
+            INTAKE_TURNS.inc(path="rules")
+            log("collect_fast_path", phase=out.phase, missing=len(out.missing), lang=out.lang)
+            return out
+    INTAKE_TURNS.inc(path="llm")
 
     messages = [
         {"role": "system", "content": COLLECT_PROMPT},
@@ -82,15 +269,18 @@ def api_collect(req: CollectRequest):
     ]
     try:
         log("collect_request", lang=req.lang)
-        rsp = client.chat.completions.create(
-            model=CHAT_DEPLOYMENT,
-            messages=messages,
-            temperature=0.0,
-            response_format={"type": "json_object"},
-        )
-        content = rsp.choices[0].message.content
-        data = json.loads(content)
-        out = CollectResponse(**data)
+        async with collect_slots:
+            with span("llm", CHAT_DEPLOYMENT):
+                rsp = await client.chat.completions.create(
+                    model=CHAT_DEPLOYMENT,
+                    messages=messages,
+                    temperature=0.0,
+                    response_format={"type": "json_object"},
+                )
+        with span("json_parse"):
+            content = rsp.choices[0].message.content
+            data = json.loads(content)
+            out = CollectResponse(**data)
         log("collect_response", phase=out.phase)
         return out
     except Exception as e:
@@ -98,64 +288,250 @@ def api_collect(req: CollectRequest):
         raise HTTPException(500, f"Collect failed: {e}")
 
 
-@app.post("/chat", response_model=ChatResponse)
-def api_chat(req: ChatRequest):
-    """
-    Q&A over KB (stateless): client provides history + user_info + question.
-    We retrieve KB chunks, then ask the model to answer strictly from them.
-    """
-    # 1) Retrieve top-k KB chunks
+async def _retrieve_hits(req: ChatRequest):
+    """Top-k KB chunks for the question (basic + HMO/tier-filtered) and the index generation."""
     try:
-        res = search_dual(req.question, hmo=req.user_info.hmo, tier=req.user_info.tier, k_basic=6, k_filtered=6, language=req.lang)
-        hits= res["basic"]+res["filtered"]
-
+        res = await run_in(search_executor, search_dual, req.question, hmo=req.user_info.hmo, tier=req.user_info.tier, k_basic=6, k_filtered=6, language=req.lang)
+        return res["merged"], res["generation"]
     except FileNotFoundError:
         raise HTTPException(400, "KB index not built. Call /build_index first.")
+    except EmbeddingMismatchError as e:
+        raise HTTPException(409, str(e))
     except Exception as e:
         log("search_error", error=str(e))
         raise HTTPException(500, f"Search failed: {e}")
 
-    # Add context to each snippet if available
-    snippets = []
-    for h in hits:
-        snippet = h["content"]
-        context = h.get("context")
-        if context:
-            snippet = f"{context}\n{snippet}"
-        snippets.append(snippet)
-
-    # 2) Build system payload for the Q&A prompt
-    system_payload = {
+
+async def _cached_answer(req: ChatRequest, hits, generation: int):
+    """
+    Exact answer-cache hit, else a near-duplicate question of the same facet
+    (semantic cache, on the embedding the search already computed).
+    Returns (cached ChatResponse dict or None, async remember(data) to store a fresh answer).
+    The answer cache may be a SQLite file: its reads and writes run on search_executor.
+    """
+    key = AnswerCache.key(
+        req.question, req.user_info.hmo, req.user_info.tier, req.lang,
+        [h["chunk_id"] for h in hits], generation, CHAT_DEPLOYMENT,
+    )
+    facet = SemanticAnswerCache.facet(req.user_info.hmo, req.user_info.tier, req.lang, generation)
+    qvec = cached_query_embedding(req.question)  # None si la recherche n'a pas eu besoin d'embedding
+
+    data = await run_in(search_executor, answer_cache.get, key)
+    if data is not None:
+        log("chat_cache_hit", kind="exact", generation=generation)
+    elif qvec is not None:
+        found = semantic_cache.get(facet, qvec)
+        if found is not None:
+            data, similarity = found
+            log("chat_cache_hit", kind="semantic", generation=generation, similarity=round(similarity, 4))
+
+    async def remember(out):
+        await run_in(search_executor, answer_cache.put, key, out)
+        if qvec is not None:
+            semantic_cache.put(facet, qvec, out)
+
+    return data, remember
+
+
+def _qa_messages(req: ChatRequest, hits):
+    """Q&A messages packed to the token budget (history trimmed, snippets deduped and ranked)."""
+    payload = {
         "lang": req.lang,
         "user_info": req.user_info.model_dump(),
         "question": req.question,
-        "kb_snippets": snippets,
     }
-    messages = [
-        {"role": "system", "content": QA_PROMPT},
-        *req.history,
-        {"role": "user", "content": json.dumps(system_payload, ensure_ascii=False)}
-    ]
-    
+    with span("prompt_build"):
+        history = _normalize_history_for_llm([m.model_dump() for m in req.history])
+        messages, tokens = pack_context(QA_PROMPT, payload, history, hits)
+    log("chat_context", **tokens)
+    return messages
 
-    # 3) Ask the model for a strict-JSON answer
-    try:
-        log("chat_request", hmo=req.user_info.hmo, tier=req.user_info.tier)
-        rsp = client.chat.completions.create(
-            model=CHAT_DEPLOYMENT,
-            messages=messages,
-            temperature=0.0,
-            response_format={"type": "json_object"},
-        )
+
+async def _answer(req: ChatRequest, hits, generation: int) -> ChatResponse:
+    """Cached answer, or a strict-JSON completion over the packed context (raises on failure)."""
+    # Same (or near-duplicate) question, facet and chunks on the same generation: reuse the answer
+    cached, remember = await _cached_answer(req, hits, generation)
+    if cached is not None:
+        return ChatResponse(**cached)
+
+    messages = _qa_messages(req, hits)
+    log("chat_request", hmo=req.user_info.hmo, tier=req.user_info.tier)
+    async with chat_slots:
+        with span("llm", CHAT_DEPLOYMENT):
+            rsp = await client.chat.completions.create(
+                model=CHAT_DEPLOYMENT,
+                messages=messages,
+                temperature=0.0,
+                response_format={"type": "json_object"},
+            )
+    with span("json_parse"):
         content = rsp.choices[0].message.content
         data = json.loads(content)
         out = ChatResponse(**data)
-        log("chat_response")
-        return out
+    await remember(out.model_dump())
+    log("chat_response")
+    return out
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def api_chat(req: ChatRequest):
+    """
+    Q&A over KB (stateless): client provides history + user_info + question.
+    We retrieve KB chunks, then ask the model to answer strictly from them.
+    """
+    # 1) Retrieve top-k KB chunks
+    hits, generation = await _retrieve_hits(req)
+
+    # 2) Ask the model for a strict-JSON answer (or reuse a cached one)
+    try:
+        return await _answer(req, hits, generation)
     except Exception as e:
         log("chat_error", error=str(e))
         raise HTTPException(500, f"Chat failed: {e}")
 
+
+@app.post("/chat/batch")
+async def api_chat_batch(batch: ChatBatchRequest):
+    """
+    Many /chat requests in one call (nightly regression, FAQ generation).
+    Retrieval is batched per language (one embedding call, one matrix
+    multiply); completions run BATCH_MAX_INFLIGHT at a time. Results stream
+    back as JSON lines in input order:
+        {"index": 0, "ok": true, "response": {...ChatResponse}}
+        {"index": 1, "ok": false, "error": "..."}
+    """
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(400, f"Batch too large: {len(batch.items)} items (max {BATCH_MAX_ITEMS}).")
+    log("chat_batch_request", items=len(batch.items))
+
+    # 1) Retrieval, one batched search per language
+    retrieved = {}
+    by_lang = {}
+    for i, req in enumerate(batch.items):
+        by_lang.setdefault(req.lang, []).append(i)
+    for lang, ids in by_lang.items():
+        queries = [(batch.items[i].question, batch.items[i].user_info.hmo, batch.items[i].user_info.tier) for i in ids]
+        try:
+            results = await run_in(search_executor, search_dual_batch, queries, k_basic=6, k_filtered=6, language=lang)
+            for i, res in zip(ids, results):
+                retrieved[i] = (res["merged"], res["generation"])
+        except FileNotFoundError:
+            for i in ids:
+                retrieved[i] = "KB index not built. Call /build_index first."
+        except EmbeddingMismatchError as e:
+            for i in ids:
+                retrieved[i] = str(e)
+        except Exception as e:
+            log("search_error", error=str(e), batch=True)
+            for i in ids:
+                retrieved[i] = f"Search failed: {e}"
+
+    # 2) Completions under a bounded pool; a failing item does not fail the batch
+    slots = asyncio.Semaphore(BATCH_MAX_INFLIGHT)
+
+    async def run_one(i: int):
+        if isinstance(retrieved[i], str):
+            return {"index": i, "ok": False, "error": retrieved[i]}
+        try:
+            async with slots:
+                out = await _answer(batch.items[i], *retrieved[i])
+            return {"index": i, "ok": True, "response": out.model_dump()}
+        except Exception as e:
+            log("chat_error", error=str(e), batch=True)
+            return {"index": i, "ok": False, "error": f"Chat failed: {e}"}
+
+    async def lines():
+        tasks = [asyncio.create_task(run_one(i)) for i in range(len(batch.items))]
+        try:
+            for task in tasks:
+                yield json.dumps(await task, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()  # client déconnecté: on n'attend pas le reste du lot
+        log("chat_batch_response", items=len(batch.items))
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/chat/stream")
+async def api_chat_stream(req: ChatRequest):
+    """
+    Streaming variant of /chat (server-sent events):
+        event: sources   retrieved KB chunks, sent before the LLM call
+        event: token     {"text": ...} answer text as the model produces it
+        event: done      the validated ChatResponse (same contract as /chat)
+        event: error     {"error": ...} if the completion fails mid-stream
+    """
+    hits, generation = await _retrieve_hits(req)
+    cached, remember = await _cached_answer(req, hits, generation)
+    sources = [
+        {"source": h.get("source"), "title": h.get("title"), "context": h.get("context"),
+         "score": h.get("score"), "cosine": h.get("cosine"), "bm25": h.get("bm25")}
+        for h in hits
+    ]
+
+    async def upstream(messages, extractor: AnswerStream, queue: "asyncio.Queue"):
+        # Lit la complétion à son rythme et ne garde le slot LLM que pendant
+        # celle-ci: un client SSE lent ne bloque pas les autres requêtes
+        try:
+            async with chat_slots:
+                with span("llm", CHAT_DEPLOYMENT):
+                    stream = await client.chat.completions.create(
+                        model=CHAT_DEPLOYMENT,
+                        messages=messages,
+                        temperature=0.0,
+                        response_format={"type": "json_object"},
+                        stream=True,
+                    )
+                    async for chunk in stream:
+                        # Azure envoie des chunks sans choices (filtres de contenu)
+                        if not chunk.choices or not chunk.choices[0].delta.content:
+                            continue
+                        text = extractor.feed(chunk.choices[0].delta.content)
+                        if text:
+                            queue.put_nowait(text)
+            queue.put_nowait(None)
+        except Exception as e:
+            queue.put_nowait(e)
+
+    async def events():
+        yield sse("sources", sources)
+        if cached is not None:
+            yield sse("token", {"text": cached["answer"]})
+            yield sse("done", cached)
+            return
+        extractor = AnswerStream()
+        queue: "asyncio.Queue" = asyncio.Queue()  # non borné: la réponse du modèle l'est
+        pump = None
+        try:
+            messages = _qa_messages(req, hits)  # seulement sans réponse en cache
+            log("chat_stream_request", hmo=req.user_info.hmo, tier=req.user_info.tier)
+            pump = asyncio.create_task(upstream(messages, extractor, queue))
+            while (item := await queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield sse("token", {"text": item})
+            with span("json_parse"):
+                out = ChatResponse(**json.loads(extractor.buf))
+            await remember(out.model_dump())
+            log("chat_stream_response", chars=len(out.answer))
+            yield sse("done", out.model_dump())
+        except Exception as e:
+            log("chat_error", error=str(e), stream=True)
+            yield sse("error", {"error": f"Chat failed: {e}"})
+        finally:
+            if pump is not None and not pump.done():
+                pump.cancel()  # client déconnecté: inutile de lire la suite
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Plusieurs workers partagent les mêmes pages d'index (mmap) et voient chaque
+    # nouvelle génération via le pointeur CURRENT (INDEX_RELOAD_CHECK_SECS)
+    workers = int(os.getenv("SERVER_WORKERS", "1"))
+    uvicorn.run("main:app" if workers > 1 else app, host="0.0.0.0", port=8000, workers=workers)
\ No newline at end of file
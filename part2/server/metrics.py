@@ -0,0 +1,169 @@
+"""
+In-process counters and latency histograms, rendered in the Prometheus text
+exposition format by GET /metrics (no client library required).
+
+Stages of a request are timed with `span`:
+
+    with span("llm", deployment=CHAT_DEPLOYMENT):
+        rsp = await client.chat.completions.create(...)
+
+Each span feeds chatbot_stage_seconds{stage, deployment} and is added to the
+per-request timings logged with the request's correlation id. Metrics are
+per process: with several uvicorn workers, scrape each one or aggregate.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(x: float) -> str:
+    if x == float("inf"):
+        return "+Inf"
+    return repr(float(x)) if x != int(x) else str(int(x))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, v in sorted(self._values.items()):
+                out.append(f"{self.name}{_labels(self.labels, key)} {_fmt(v)}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List[float]] = {}  # bucket counts..., sum, count
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0.0
+                for bound, n in zip(self.buckets, series):
+                    cumulative += n
+                    le = _labels(self.labels, key, 'le="%s"' % _fmt(bound))
+                    out.append(f"{self.name}_bucket{le} {_fmt(cumulative)}")
+                le = _labels(self.labels, key, 'le="+Inf"')
+                out.append(f"{self.name}_bucket{le} {_fmt(series[-1])}")
+                out.append(f"{self.name}_sum{_labels(self.labels, key)} {_fmt(series[-2])}")
+                out.append(f"{self.name}_count{_labels(self.labels, key)} {_fmt(series[-1])}")
+        return out
+
+
+class GaugeCallback:
+    """Gauge (or counter) whose samples are read from `fn` at scrape time: {label values: value}."""
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Dict[LabelValues, float]],
+                 labels: Sequence[str] = (), kind: str = "gauge"):
+        self.name, self.help, self.fn, self.labels, self.kind = name, help, fn, tuple(labels), kind
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, v in sorted(self.fn().items()):
+            out.append(f"{self.name}{_labels(self.labels, key)} {_fmt(v)}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        m = Counter(name, help, labels)
+        self._metrics.append(m)
+        return m
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        m = Histogram(name, help, labels, buckets)
+        self._metrics.append(m)
+        return m
+
+    def callback(self, name: str, help: str, fn: Callable[[], Dict[LabelValues, float]],
+                 labels: Sequence[str] = (), kind: str = "gauge") -> GaugeCallback:
+        m = GaugeCallback(name, help, fn, labels, kind)
+        self._metrics.append(m)
+        return m
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "chatbot_stage_seconds", "Duration of one request stage.", ("stage", "deployment"),
+)
+STAGE_ERRORS = registry.counter(
+    "chatbot_stage_errors_total", "Stages that raised.", ("stage", "deployment"),
+)
+
+# Durées par étape de la requête en cours (partagées avec les threads via copy_context)
+_request_spans: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_spans", default=None)
+
+
+def start_request_spans() -> Dict[str, float]:
+    spans: Dict[str, float] = {}
+    _request_spans.set(spans)
+    return spans
+
+
+@contextmanager
+def span(stage: str, deployment: str = "") -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage, deployment=deployment)
+        raise
+    finally:
+        dt = time.perf_counter() - t0
+        STAGE_SECONDS.observe(dt, stage=stage, deployment=deployment)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans[stage] = round(spans.get(stage, 0.0) + dt, 6)
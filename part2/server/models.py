@@ -59,3 +59,6 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     sources: List[str] = Field(default_factory=list)
+
+class ChatBatchRequest(BaseModel):
+    items: List[ChatRequest]
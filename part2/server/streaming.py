@@ -0,0 +1,79 @@
+"""
+Server-sent events for the streaming /chat endpoint.
+
+The model still answers in strict JSON ({"answer": ..., "sources": [...]});
+AnswerStream pulls the "answer" text out of the partial JSON as it arrives so
+the client can render it before the completion is finished.
+"""
+import json
+import re
+from typing import Any, Optional
+
+_ANSWER_KEY = re.compile(r'"answer"\s*:\s*"')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+def sse(event: str, data: Any) -> str:
+    """One server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class AnswerStream:
+    """
+    Incrementally extracts the "answer" string of a strict-JSON completion
+    while it is being streamed, so its text can be forwarded token by token.
+    Usage:
+        extractor = AnswerStream()
+        for delta in chunks:
+            text = extractor.feed(delta)   # newly decoded answer text ('' if none)
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.pos: Optional[int] = None  # position courante dans la valeur de "answer"
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        self.buf += chunk
+        if self.done:
+            return ""
+        if self.pos is None:
+            m = _ANSWER_KEY.search(self.buf)
+            if not m:
+                return ""
+            self.pos = m.end()
+
+        out = []
+        i, buf = self.pos, self.buf
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+            # séquence d'échappement: attendre qu'elle soit complète
+            if i + 1 >= len(buf):
+                break
+            esc = buf[i + 1]
+            if esc != "u":
+                out.append(_ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            code = int(buf[i + 2:i + 6], 16)
+            if 0xD800 <= code <= 0xDBFF:  # paire de substitution: il faut les deux moitiés
+                if i + 12 > len(buf):
+                    break
+                low = int(buf[i + 8:i + 12], 16)
+                out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+            else:
+                out.append(chr(code))
+                i += 6
+        self.pos = i
+        return "".join(out)
@@ -0,0 +1,117 @@
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+
+def l2_normalize(x: np.ndarray, eps: float = 1e-12) -> np.ndarray:
+    """Return a float32 copy of `x` with every row scaled to unit length."""
+    x = np.asarray(x, dtype="float32")
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, eps)
+
+
+def is_normalized(vecs: np.ndarray, atol: float = 1e-3) -> bool:
+    if vecs.shape[0] == 0:
+        return True
+    sq = np.einsum("ij,ij->i", vecs, vecs, dtype="float32")
+    return bool(np.all(np.abs(sq - 1.0) <= atol))
+
+
+def top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Best `k` columns of each row of `scores`, sorted by descending score.
+    Accepts a 1-D vector (one query) or a 2-D (queries x rows) matrix.
+    """
+    single = scores.ndim == 1
+    s = np.atleast_2d(scores)
+    n = s.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        empty = np.zeros((s.shape[0], 0))
+        return (empty[0].astype(np.int64), empty[0]) if single else (empty.astype(np.int64), empty)
+    if k < n:
+        part = np.argpartition(-s, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(n), (s.shape[0], n))
+    part_scores = np.take_along_axis(s, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    idx = np.take_along_axis(part, order, axis=1)
+    vals = np.take_along_axis(part_scores, order, axis=1)
+    if single:
+        return idx[0], vals[0]
+    return idx, vals
+
+
+def top_k_in(
+    scores: np.ndarray,
+    k: int,
+    rows: Optional[Union[slice, np.ndarray]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """top_k of a full 1-D score vector restricted to `rows`; indices refer to the full vector."""
+    if rows is None:
+        return top_k(scores, k)
+    if isinstance(rows, slice):
+        idx, vals = top_k(scores[rows], k)
+        return idx + (rows.start or 0), vals
+    rows = np.asarray(rows)
+    idx, vals = top_k(scores[rows], k)
+    return rows[idx], vals
+
+
+# Taille des blocs convertis en float32 pour scorer un index float16/int8
+BLOCK_ROWS = 8192
+
+
+def cosine_scores(vecs: np.ndarray, queries: np.ndarray, scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Cosine scores of (normalized) `queries` against a pre-normalized matrix:
+    a single BLAS matmul, no per-query renormalization of `vecs`.
+    float16 / int8 matrices are upcast block by block (int8 rows are rescaled
+    by `scales`) so memory stays bounded by BLOCK_ROWS.
+    """
+    q = l2_normalize(np.atleast_2d(queries))
+    if vecs.dtype == np.float32:
+        scores = q @ vecs.T
+    else:
+        scores = np.empty((q.shape[0], vecs.shape[0]), dtype="float32")
+        for a in range(0, vecs.shape[0], BLOCK_ROWS):
+            b = min(a + BLOCK_ROWS, vecs.shape[0])
+            scores[:, a:b] = q @ vecs[a:b].astype("float32").T
+        if scales is not None:
+            scores *= np.asarray(scales, dtype="float32")
+    return scores[0] if np.ndim(queries) == 1 else scores
+
+
+# Au-delà de cette fraction de lignes, scorer toute la matrice puis filtrer
+# coûte moins cher que copier la sous-matrice (fancy indexing).
+MASK_FRACTION = 0.25
+
+
+def search(
+    vecs: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+    rows: Optional[Union[slice, np.ndarray]] = None,
+    scales: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k cosine search. `queries` may be one vector or a (m, d) matrix.
+    `rows` restricts the search to a subset of `vecs`: a slice is scored as a
+    zero-copy view, a sorted index array either via a gathered sub-matrix or by
+    masking the full score vector. `scales` are the per-row factors of an int8
+    index. Returned indices always refer to rows of the full matrix.
+    """
+    if rows is None:
+        return top_k(cosine_scores(vecs, queries, scales), k)
+    if isinstance(rows, slice):
+        start = rows.start or 0
+        sub_scales = None if scales is None else scales[rows]
+        idx, vals = top_k(cosine_scores(vecs[rows], queries, sub_scales), k)
+        return idx + start, vals
+    rows = np.asarray(rows)
+    if len(rows) >= MASK_FRACTION * vecs.shape[0]:
+        scores = cosine_scores(vecs, queries, scales)[..., rows]
+    else:
+        scores = cosine_scores(vecs[rows], queries, None if scales is None else scales[rows])
+    idx, vals = top_k(scores, k)
+    return rows[idx], vals